@@ -1,9 +1,28 @@
 from google.cloud import bigquery
 from google.oauth2 import service_account
 
+import uuid
+import queue
+import threading
 import pandas as pd
 from datetime import date, timedelta, datetime
 from google.cloud import exceptions
+from Connectors.Instrumentation import metrics
+from Connectors.StagingStore import is_parquet_source, get_parquet_columns
+
+try:
+    # optional, enables the fast download through the Storage Read API (Arrow streams).
+    from google.cloud import bigquery_storage
+except ImportError:
+    bigquery_storage = None
+
+# The table that holds the sync watermarks, one row per sync.
+STATE_TABLE_NAME = "etl_state"
+DEFAULT_MAX_READ_STREAMS = 4
+# merge_rows loads the rows into a table named <table><STAGING_TABLE_INFIX><random hex>.
+STAGING_TABLE_INFIX = "_staging_"
+# table schema types that are named differently as query parameter types.
+LEGACY_TYPES_TO_PARAMETER_TYPES = {"INTEGER": "INT64", "FLOAT": "FLOAT64", "BOOLEAN": "BOOL", "RECORD": "STRUCT"}
 
 
 def check_types(arg_list, expected_types):
@@ -20,19 +39,157 @@ def increase_date_by_day(to_date):
     return to_date
 
 
+def build_merge_sql(target_table_id, source_table_id, columns, key_columns):
+    """
+    :return: MERGE statement that updates the rows of the target table that match the source rows by the key
+             columns, and inserts the rest.
+    """
+    on_condition = " AND ".join("T.`%s` = S.`%s`" % (column, column) for column in key_columns)
+    update_columns = [column for column in columns if column not in key_columns]
+    columns_list = ", ".join("`%s`" % column for column in columns)
+    sql = """
+            MERGE `%s` T
+            USING `%s` S
+            ON %s
+        """ % (target_table_id, source_table_id, on_condition)
+    if update_columns:
+        sql += """
+            WHEN MATCHED THEN UPDATE SET %s
+        """ % ", ".join("`%s` = S.`%s`" % (column, column) for column in update_columns)
+    sql += """
+            WHEN NOT MATCHED THEN INSERT (%s) VALUES (%s)
+        """ % (columns_list, ", ".join("S.`%s`" % column for column in columns))
+    return sql
+
+
+def build_replace_window_sql(target_table_id, source_table_id, column_types, date_column_name):
+    """
+    :param column_types: dict of column name -> the column's type in the target table, the source columns are cast
+           to them.
+    :return: transaction that deletes the target rows in [@from_date, @to_date) and inserts the source rows instead,
+             without a source table only the delete.
+    """
+    sql = """
+            BEGIN TRANSACTION;
+            DELETE `%s` WHERE `%s` >= @from_date AND `%s` < @to_date;
+        """ % (target_table_id, date_column_name, date_column_name)
+    if source_table_id is not None:
+        columns_list = ", ".join("`%s`" % column for column in column_types)
+        select_list = ", ".join("CAST(`%s` AS %s)" % (column, get_parameter_type(column_types, column))
+                                for column in column_types)
+        sql += """
+            INSERT INTO `%s` (%s) SELECT %s FROM `%s`;
+        """ % (target_table_id, columns_list, select_list, source_table_id)
+    sql += """
+            COMMIT TRANSACTION;
+        """
+    return sql
+
+
+def build_select_list(columns):
+    if columns is None:
+        return "*"
+    return ", ".join("`%s`" % column for column in columns)
+
+
+def get_parameter_type(column_types, column):
+    """
+    :param column_types: dict of column name -> the column's type in the table schema.
+    :return: string represents the query parameter type that matches the column, "STRING" when the type is unknown.
+    """
+    field_type = column_types.get(column, "STRING")
+    return LEGACY_TYPES_TO_PARAMETER_TYPES.get(field_type, field_type)
+
+
+def build_where_conditions(where, column_types):
+    """
+    Builds parameterized conditions: "col = @p0" for a single value and "col IN UNNEST(@p0)" for a list of values.
+    :param where: dict of column name -> value (or list of values), may be None.
+    :param column_types: dict of column name -> the column's type in the table schema.
+    :return: (list of conditions, list of query parameters)
+    """
+    conditions = []
+    query_parameters = []
+    for i, (column, value) in enumerate((where or {}).items()):
+        parameter_name = "p%d" % i
+        parameter_type = get_parameter_type(column_types, column)
+        if isinstance(value, (list, tuple, set)):
+            conditions.append("`%s` IN UNNEST(@%s)" % (column, parameter_name))
+            query_parameters.append(bigquery.ArrayQueryParameter(parameter_name, parameter_type, list(value)))
+        elif value is None:
+            conditions.append("`%s` IS NULL" % column)
+        else:
+            conditions.append("`%s` = @%s" % (column, parameter_name))
+            query_parameters.append(bigquery.ScalarQueryParameter(parameter_name, parameter_type, value))
+    return conditions, query_parameters
+
+
+def compact_dtypes(df, max_category_ratio=0.5):
+    """
+    Converts the df columns to compact dtypes: Yes/No (True/False/None) columns to "boolean", integer columns to the
+    smallest nullable integer dtype (Int8, Int16, etc.) and string columns with few distinct values to "category".
+    :param df: the df to convert.
+    :param max_category_ratio: float, string columns with distinct values / rows up to it are converted to category.
+    :return: the converted df.
+    """
+    converted_columns = {}
+    for column in df.columns:
+        values = df[column]
+        not_null_values = values.dropna()
+        if pd.api.types.is_bool_dtype(values) or (
+                values.dtype == object and len(not_null_values) and not_null_values.map(type).eq(bool).all()):
+            converted_columns[column] = values.astype("boolean")
+        elif pd.api.types.is_integer_dtype(values):
+            downcast_values = pd.to_numeric(values, downcast="integer")
+            converted_columns[column] = downcast_values.astype(downcast_values.dtype.name.capitalize())
+        elif (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)) and len(values) and \
+                not_null_values.map(type).eq(str).all() and \
+                not_null_values.nunique() <= max_category_ratio * len(values):
+            converted_columns[column] = values.astype("category")
+    return df.assign(**converted_columns) if converted_columns else df
+
+
+def convert_dtypes(df, dtypes=None, compact=False):
+    if compact:
+        df = compact_dtypes(df)
+    if dtypes:
+        df = df.astype(dtypes)
+    return df
+
+
 class BigqueryConnector:
 
-    def __init__(self, json_path):
+    def __init__(self, json_path, query_cache=None, max_bytes_billed=None, use_storage_api=True):
+        """
+        :param json_path: path to the service account json file.
+        :param query_cache: QueryCache to serve repeated SELECT queries from, None for no caching.
+        :param max_bytes_billed: int represents the maximal bytes a query may process, queries estimated
+               (by dry run) to process more are refused. None for no limit.
+        :param use_storage_api: whether to download results through the Storage Read API (when
+               google-cloud-bigquery-storage is installed) instead of paging them over the REST API.
+        """
         credentials = service_account.Credentials.from_service_account_file(
             json_path, scopes=["https://www.googleapis.com/auth/cloud-platform"])
         self.db_name = credentials.project_id
         self.client = bigquery.Client(credentials=credentials, project=credentials.project_id)
+        self.bqstorage_client = None
+        if use_storage_api and bigquery_storage is not None:
+            self.bqstorage_client = bigquery_storage.BigQueryReadClient(credentials=credentials)
+        self.query_cache = query_cache
+        self.max_bytes_billed = max_bytes_billed
+        # table id -> the lock the transactions on the table run under (see get_table_lock).
+        self.table_locks = {}
+        self.table_locks_lock = threading.Lock()
 
-    def get_dim_full_table(self, scheme_name, table_name):
+    def get_dim_full_table(self, scheme_name, table_name, columns=None, where=None, dtypes=None, compact=False):
         """
         Retrieves the full wanted table from bigQuery, as pandas df.
         :param scheme_name: string represents the scheme name ("mrr", "dwh", etc.)
         :param table_name: string represents the table name.
+        :param columns: list of strings represents the columns to retrieve, None for all the columns.
+        :param where: dict of column name -> value (or list of values) the rows are filtered by, None for all the rows.
+        :param dtypes: dict of column name -> dtype to convert the retrieved columns to.
+        :param compact: whether to convert the columns to compact dtypes (see compact_dtypes).
         :return: df with all the table's rows.
 
         :raise TypeError when any arg is not a string
@@ -41,14 +198,19 @@ class BigqueryConnector:
         """
         check_types([scheme_name, table_name], [str, str])
         full_table_id = self.build_table_id(scheme_name, table_name)
+        conditions, query_parameters = build_where_conditions(where, self.get_column_types(full_table_id, where))
         sql = """
-                SELECT *
+                SELECT %s
                 FROM `%s`
-            """ % full_table_id
-        return self.perform_sql_query_to_df(sql)
+            """ % (build_select_list(columns), full_table_id)
+        if conditions:
+            sql += """
+                WHERE %s
+            """ % " AND ".join(conditions)
+        return convert_dtypes(self.perform_sql_query_to_df(sql, query_parameters), dtypes, compact)
 
     def get_table(self, scheme_name, table_name, date_column_name="Date", from_date=str(date.today()),
-                  to_date=str(date.today())):
+                  to_date=str(date.today()), columns=None, where=None, dtypes=None, compact=False):
         """
         Retrieves the wanted table from bigQuery as pandas df.
         Returns the rows from the current day (default behaviour) or filtered according to given time interval
@@ -58,6 +220,11 @@ class BigqueryConnector:
         :param date_column_name: string represents the name of the column that holds the date information.
         :param from_date: string represents the interval's start date, format "YYYY-MM-DD"
         :param to_date: string represents the interval's end date, format "YYYY-MM-DD".
+        :param columns: list of strings represents the columns to retrieve, None for all the columns.
+        :param where: dict of column name -> value (or list of values) the rows are filtered by, in addition to the
+               time interval.
+        :param dtypes: dict of column name -> dtype to convert the retrieved columns to.
+        :param compact: whether to convert the columns to compact dtypes (see compact_dtypes).
         :return: df with all the table's rows filtered be time.
 
         :raise TypeError when any arg is not a string
@@ -69,12 +236,18 @@ class BigqueryConnector:
         # midnight (when the day starts).
         to_date = increase_date_by_day(to_date)
         full_table_id = self.build_table_id(scheme_name, table_name)
+        column_types = self.get_column_types(full_table_id, dict(where or {}, **{date_column_name: None}))
+        date_type = get_parameter_type(column_types, date_column_name)
+        conditions, query_parameters = build_where_conditions(where, column_types)
+        conditions.insert(0, "`%s` between @from_date and @to_date" % date_column_name)
+        query_parameters += [bigquery.ScalarQueryParameter("from_date", date_type, from_date),
+                             bigquery.ScalarQueryParameter("to_date", date_type, str(to_date))]
         sql = """
-                SELECT *
+                SELECT %s
                 FROM `%s`
-                WHERE %s between "%s" and "%s"
-            """ % (full_table_id, date_column_name, from_date, to_date)
-        return self.perform_sql_query_to_df(sql)
+                WHERE %s
+            """ % (build_select_list(columns), full_table_id, " AND ".join(conditions))
+        return convert_dtypes(self.perform_sql_query_to_df(sql, query_parameters), dtypes, compact)
 
     def get_newest_event_date(self, scheme_name, table_name, date_column_name="Date"):
         """
@@ -98,12 +271,17 @@ class BigqueryConnector:
         latest_update = df.iloc[0]["Max_Date"]
         return latest_update.date()
 
-    def load_new_table(self, scheme_name, table_name, df):
+    def load_new_table(self, scheme_name, table_name, df, partition_column=None, clustering_columns=None,
+                       schema=None):
         """
         Loads df to new table in bigQuery as: projectId.scheme.tableName.
         :param scheme_name: string represents the scheme name ("mrr", "dwh", etc.)
         :param table_name: string represents the table name.
         :param df: contains the new table's rows
+        :param partition_column: string represents the date/timestamp column the table is partitioned by (daily),
+               None for unpartitioned table.
+        :param clustering_columns: list of strings represents the columns the table is clustered by (up to 4).
+        :param schema: list of bigquery.SchemaField, None to detect the schema from df.
         :return:
 
         :raise TypeError when incompatible args types
@@ -112,7 +290,8 @@ class BigqueryConnector:
         :raise other Exception when another error has occurred.
         """
         check_types([scheme_name, table_name, df], [str, str, pd.core.frame.DataFrame])
-        self.load_table(self.build_table_id(scheme_name, table_name), df, "WRITE_EMPTY")
+        self.load_table(self.build_table_id(scheme_name, table_name), df, "WRITE_EMPTY", partition_column,
+                        clustering_columns, schema)
 
     def load_new_rows_to_exist_table(self, scheme_name, table_name, df):
         """
@@ -160,15 +339,307 @@ class BigqueryConnector:
         self.perform_sql_query_to_df(sql)
         self.load_new_rows_to_exist_table(scheme_name, table_name, df)
 
+    def replace_rows_in_window(self, scheme_name, table_name, df, from_date, to_date, date_column_name="Date"):
+        """
+        Replaces the rows in the given interval [from_date, to_date] by df, atomically: the rows are loaded into a
+        staging table and the delete and the insert run in one transaction, so loading the same window again gives
+        the same table and a failure leaves the window as it was.
+        Unlike replace_rows_in_time_range, the interval ends before the midnight after to_date, so adjacent windows
+        can be replaced concurrently: the staging loads run in parallel, while the transactions on the same table run
+        one at a time, as BigQuery aborts a transaction that conflicts with another one modifying the table.
+        :param scheme_name: string represents the scheme name ("mrr", "dwh", etc.)
+        :param table_name: string represents the table name.
+        :param df: contains the new rows of the interval, may be empty. Can be also a list of parquet files paths
+               (e.g. StagingStore.get_paths), then the files are loaded as they are.
+        :param from_date: string represents the interval's start date, format "YYYY-MM-DD"
+        :param to_date: string represents the interval's end date, format "YYYY-MM-DD".
+        :param date_column_name: string represents the name of the column that holds the date information.
+        :return:
+
+        :raise TypeError when incompatible args types
+        :raise ValueError when projectId.scheme.tableName is not exist
+        :raise other Exception when another error has occurred.
+        """
+        check_types([scheme_name, table_name, from_date, to_date, date_column_name], [str, str, str, str, str])
+        if not isinstance(df, pd.DataFrame) and not is_parquet_source(df):
+            raise TypeError("Illegal type, expected a df or a list of parquet files paths")
+        full_table_id = self.build_table_id(scheme_name, table_name)
+        self.assert_table_is_exist(full_table_id)
+        table_types = {field.name: field.field_type for field in self.client.get_table(full_table_id).schema}
+        date_type = get_parameter_type(table_types, date_column_name)
+        query_parameters = [bigquery.ScalarQueryParameter("from_date", date_type, from_date),
+                            bigquery.ScalarQueryParameter("to_date", date_type, str(increase_date_by_day(to_date)))]
+        if isinstance(df, pd.DataFrame):
+            columns = [] if df.empty else list(df.columns)
+        else:
+            columns = get_parquet_columns(df)
+        if not columns:
+            with self.get_table_lock(full_table_id):
+                self.perform_sql_query_to_df(build_replace_window_sql(full_table_id, None, None, date_column_name),
+                                             query_parameters)
+            return
+        staging_table_id = self.build_table_id(scheme_name, table_name + STAGING_TABLE_INFIX + uuid.uuid4().hex)
+        with metrics.span("bigquery_replace_window", table=full_table_id):
+            try:
+                self.load_table(staging_table_id, df, "WRITE_TRUNCATE")
+                # the staged columns are cast to the table's types, so the insert does not depend on detected types.
+                sql = build_replace_window_sql(full_table_id, staging_table_id,
+                                               {column: table_types.get(column, "STRING") for column in columns},
+                                               date_column_name)
+                with self.get_table_lock(full_table_id):
+                    self.perform_sql_query_to_df(sql, query_parameters)
+            finally:
+                self.client.delete_table(staging_table_id, not_found_ok=True)
+
+    def migrate_to_partitioned_table(self, scheme_name, table_name, new_table_name, partition_column="Date",
+                                     clustering_columns=None):
+        """
+        Copies exist table into new table partitioned by day on the given column (and optionally clustered), so
+        queries filtered by date scan only the relevant partitions.
+        The original table is kept, replacing it by the new table is left to the caller.
+        :param scheme_name: string represents the scheme name ("mrr", "dwh", etc.)
+        :param table_name: string represents the name of the table to copy.
+        :param new_table_name: string represents the name of the new partitioned table.
+        :param partition_column: string represents the date/timestamp column the table is partitioned by.
+        :param clustering_columns: list of strings represents the columns the table is clustered by (up to 4).
+        :return:
+
+        :raise TypeError when incompatible args types
+        :raise ValueError when projectId.scheme.tableName is not exist or the partition column is not a date
+        :raise other Exception when another error has occurred.
+        """
+        check_types([scheme_name, table_name, new_table_name, partition_column],
+                    [str, str, str, str])
+        full_table_id = self.build_table_id(scheme_name, table_name)
+        self.assert_table_is_exist(full_table_id)
+        column_types = {field.name: field.field_type for field in self.client.get_table(full_table_id).schema}
+        if column_types.get(partition_column) == "DATE":
+            partition_expression = "`%s`" % partition_column
+        elif column_types.get(partition_column) in ["TIMESTAMP", "DATETIME"]:
+            partition_expression = "DATE(`%s`)" % partition_column
+        else:
+            raise ValueError("Column " + partition_column + " of " + full_table_id + " is not a date column")
+        cluster_by = ""
+        if clustering_columns:
+            cluster_by = "CLUSTER BY " + ", ".join("`%s`" % column for column in clustering_columns)
+        sql = """
+                CREATE TABLE `%s`
+                PARTITION BY %s
+                %s
+                AS SELECT * FROM `%s`
+            """ % (self.build_table_id(scheme_name, new_table_name), partition_expression, cluster_by, full_table_id)
+        self.perform_sql_query_to_df(sql)
+
+    def create_table_if_not_exists(self, scheme_name, table_name, schema, clustering_columns=None):
+        """
+        Creates empty table with the given schema, unless it already exists.
+        :param scheme_name: string represents the scheme name ("mrr", "dwh", etc.)
+        :param table_name: string represents the table name.
+        :param schema: list of bigquery.SchemaField.
+        :param clustering_columns: list of strings represents the columns the table is clustered by (up to 4).
+        :return:
+
+        :raise TypeError when incompatible args types
+        :raise other Exception when another error has occurred.
+        """
+        check_types([scheme_name, table_name, schema], [str, str, list])
+        columns = ", ".join("`%s` %s%s" % (field.name, field.field_type,
+                                           " NOT NULL" if field.mode == "REQUIRED" else "") for field in schema)
+        cluster_by = ""
+        if clustering_columns:
+            cluster_by = "CLUSTER BY " + ", ".join("`%s`" % column for column in clustering_columns)
+        sql = """
+                CREATE TABLE IF NOT EXISTS `%s` (%s)
+                %s
+            """ % (self.build_table_id(scheme_name, table_name), columns, cluster_by)
+        self.perform_sql_query_to_df(sql)
+
+    def merge_rows(self, scheme_name, table_name, df, key_columns):
+        """
+        Upserts df into exist table: rows whose key already exists are updated and the other rows are inserted.
+        The rows are loaded into a staging table (with the table's column types) and merged by one atomic MERGE
+        statement, so the table is never left partially updated. When df holds the same key more than once, the last
+        row is taken.
+        :param scheme_name: string represents the scheme name ("mrr", "dwh", etc.)
+        :param table_name: string represents the table name.
+        :param df: contains the new and the updated rows.
+        :param key_columns: list of strings represents the columns that identify a row.
+        :return:
+
+        :raise TypeError when incompatible args types
+        :raise ValueError when projectId.scheme.tableName is not exist
+        :raise other Exception when another error has occurred.
+        """
+        check_types([scheme_name, table_name, df, key_columns], [str, str, pd.core.frame.DataFrame, list])
+        full_table_id = self.build_table_id(scheme_name, table_name)
+        self.assert_table_is_exist(full_table_id)
+        if df.empty:
+            return
+        df = df.drop_duplicates(subset=key_columns, keep="last")
+        # the staging table takes the target's types, instead of types detected from the dtypes (naive datetimes
+        # would be DATETIME and all None columns would have no usable type), so the MERGE type checks.
+        schema = [field for field in self.client.get_table(full_table_id).schema if field.name in df.columns]
+        staging_table_id = self.build_table_id(scheme_name, table_name + STAGING_TABLE_INFIX + uuid.uuid4().hex)
+        with metrics.span("bigquery_merge", table=full_table_id):
+            try:
+                self.load_table(staging_table_id, df, "WRITE_TRUNCATE", schema=schema)
+                self.perform_sql_query_to_df(build_merge_sql(full_table_id, staging_table_id, list(df.columns),
+                                                             key_columns))
+            finally:
+                self.client.delete_table(staging_table_id, not_found_ok=True)
+
+    def replace_table_rows(self, scheme_name, table_name, df):
+        """
+        Replaces all the rows of exist table by df, by one load job (WRITE_TRUNCATE), keeping the table's column types
+        and clustering. The rows that are not in df are removed.
+        :param scheme_name: string represents the scheme name ("mrr", "dwh", etc.)
+        :param table_name: string represents the table name.
+        :param df: contains all the table's rows.
+        :return:
+
+        :raise TypeError when incompatible args types
+        :raise ValueError when projectId.scheme.tableName is not exist
+        :raise other Exception when another error has occurred.
+        """
+        check_types([scheme_name, table_name, df], [str, str, pd.core.frame.DataFrame])
+        full_table_id = self.build_table_id(scheme_name, table_name)
+        self.assert_table_is_exist(full_table_id)
+        table = self.client.get_table(full_table_id)
+        self.load_table(full_table_id, df, "WRITE_TRUNCATE", clustering_columns=table.clustering_fields,
+                        schema=[field for field in table.schema if field.name in df.columns])
+
+    def get_watermark(self, scheme_name, sync_name):
+        """
+        Returns the date the given sync should resume from, as saved by set_watermark.
+        :param scheme_name: string represents the scheme name of the state table ("mrr", "dwh", etc.)
+        :param sync_name: string represents the sync name, e.g. the name of the synced table.
+        :return: Type datetime.date, or None when the sync has no watermark yet.
+
+        :raise TypeError when incompatible args types
+        :raise other Exception when another error has occurred.
+        """
+        check_types([scheme_name, sync_name], [str, str])
+        full_table_id = self.create_state_table_if_not_exists(scheme_name)
+        sql = """
+                SELECT Watermark
+                FROM `%s`
+                WHERE Sync_Name = @sync_name
+            """ % full_table_id
+        df = self.perform_sql_query_to_df(sql, [bigquery.ScalarQueryParameter("sync_name", "STRING", sync_name)])
+        if df.empty:
+            return None
+        return pd.to_datetime(df.iloc[0]["Watermark"]).date()
+
+    def set_watermark(self, scheme_name, sync_name, watermark):
+        """
+        Saves the date the given sync should resume from.
+        :param scheme_name: string represents the scheme name of the state table ("mrr", "dwh", etc.)
+        :param sync_name: string represents the sync name, e.g. the name of the synced table.
+        :param watermark: string represents the date, format "YYYY-MM-DD".
+        :return:
+
+        :raise TypeError when incompatible args types
+        :raise other Exception when another error has occurred.
+        """
+        check_types([scheme_name, sync_name, watermark], [str, str, str])
+        full_table_id = self.create_state_table_if_not_exists(scheme_name)
+        sql = """
+                MERGE `%s` T
+                USING (SELECT @sync_name AS Sync_Name, @watermark AS Watermark) S
+                ON T.Sync_Name = S.Sync_Name
+                WHEN MATCHED THEN UPDATE SET Watermark = S.Watermark, Updated_At = CURRENT_TIMESTAMP()
+                WHEN NOT MATCHED THEN INSERT (Sync_Name, Watermark, Updated_At)
+                VALUES (S.Sync_Name, S.Watermark, CURRENT_TIMESTAMP())
+            """ % full_table_id
+        self.perform_sql_query_to_df(sql, [bigquery.ScalarQueryParameter("sync_name", "STRING", sync_name),
+                                           bigquery.ScalarQueryParameter("watermark", "DATE", watermark)])
+
+    def dry_run(self, sql_query, query_parameters=None):
+        """
+        Validates the query and estimates its cost without running it.
+        :param sql_query: string represents the query.
+        :param query_parameters: list of bigquery query parameters the query uses.
+        :return: int represents the amount of bytes the query would process.
+
+        :raise google.api_core.exception when the query is invalid.
+        """
+        return self.perform_dry_run(sql_query, query_parameters).total_bytes_processed
+
+    def iter_batches(self, scheme_name, table_name, columns=None, row_filter=None,
+                     max_streams=DEFAULT_MAX_READ_STREAMS):
+        """
+        Reads the table through the Storage Read API and yields it chunk by chunk, so large tables can be processed
+        with bounded memory. The table is read by up to max_streams parallel Arrow streams, so the order of the
+        chunks (and of the rows) is not kept.
+        :param scheme_name: string represents the scheme name ("mrr", "dwh", etc.)
+        :param table_name: string represents the table name.
+        :param columns: list of strings represents the columns to read, None for all the columns.
+        :param row_filter: string represents SQL condition the rows are filtered by on the server,
+               e.g. 'Date >= "2021-12-01"', None for all the rows.
+        :param max_streams: int represents the maximal amount of streams read in parallel.
+        :return: yields df per chunk of rows.
+
+        :raise TypeError when incompatible args types
+        :raise ValueError when projectId.scheme.tableName is not exist or google-cloud-bigquery-storage is missing
+        :raise other Exception when another error has occurred.
+        """
+        check_types([scheme_name, table_name], [str, str])
+        full_table_id = self.build_table_id(scheme_name, table_name)
+        self.assert_table_is_exist(full_table_id)
+        if self.bqstorage_client is None:
+            raise ValueError("Reading by batches requires google-cloud-bigquery-storage and use_storage_api")
+        read_options = bigquery_storage.types.ReadSession.TableReadOptions(selected_fields=columns or [],
+                                                                           row_restriction=row_filter or "")
+        requested_session = bigquery_storage.types.ReadSession(
+            table="projects/%s/datasets/%s/tables/%s" % (self.db_name, scheme_name, table_name),
+            data_format=bigquery_storage.types.DataFormat.ARROW, read_options=read_options)
+        session = self.bqstorage_client.create_read_session(parent="projects/" + self.db_name,
+                                                            read_session=requested_session,
+                                                            max_stream_count=max_streams)
+        yield from self.iter_streams(session)
+
+    def read_table(self, scheme_name, table_name, columns=None, row_filter=None, max_streams=DEFAULT_MAX_READ_STREAMS):
+        """
+        Reads the whole table (or the selected columns and rows of it) through the Storage Read API into one df,
+        without running a query. See iter_batches for the params.
+        """
+        batches = list(self.iter_batches(scheme_name, table_name, columns, row_filter, max_streams))
+        if not batches:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(batches, ignore_index=True)
+
     # def get_last_modified_date(self): //todo when we have "modified_date"
 
     # ------------------------------- inner methods (not as part of the API) ------------------------------------
 
-    def load_table(self, full_table_id, df, write_config):
+    def load_table(self, full_table_id, df, write_config, partition_column=None, clustering_columns=None, schema=None):
+        """
+        Loads df, or a list of parquet files paths, into the table. Parquet files are loaded as they are (without
+        building a df), one load job per file: the first one by write_config and the others append.
+        """
         job_config = bigquery.LoadJobConfig(write_disposition=write_config)
+        if partition_column is not None:
+            job_config.time_partitioning = bigquery.TimePartitioning(type_=bigquery.TimePartitioningType.DAY,
+                                                                     field=partition_column)
+        if clustering_columns is not None:
+            job_config.clustering_fields = clustering_columns
+        if schema is not None:
+            job_config.schema = schema
         try:
-            job = self.client.load_table_from_dataframe(df, full_table_id, job_config=job_config)
-            job.result()
+            # the staging tables are labeled as their target table, so the labels don't grow with every merge.
+            with metrics.span("bigquery_load", table=full_table_id.split(STAGING_TABLE_INFIX)[0]) as load_span:
+                if isinstance(df, pd.DataFrame):
+                    job = self.client.load_table_from_dataframe(df, full_table_id, job_config=job_config)
+                    job.result()
+                    load_span.add("bigquery_rows", len(df))
+                else:
+                    job_config.source_format = bigquery.SourceFormat.PARQUET
+                    for path in [df] if isinstance(df, str) else df:
+                        with open(path, "rb") as parquet_file:
+                            job = self.client.load_table_from_file(parquet_file, full_table_id, job_config=job_config)
+                            job.result()
+                        job_config.write_disposition = "WRITE_APPEND"
+                        load_span.add("bigquery_rows", job.output_rows or 0)
         except exceptions.Conflict:
             raise ValueError("Table " + full_table_id + " is already exists")
         except exceptions.NotFound:
@@ -176,15 +647,119 @@ class BigqueryConnector:
         except Exception as ex:
             raise ex
 
+    def create_state_table_if_not_exists(self, scheme_name):
+        full_table_id = self.build_table_id(scheme_name, STATE_TABLE_NAME)
+        sql = """
+                CREATE TABLE IF NOT EXISTS `%s` (
+                    Sync_Name STRING NOT NULL,
+                    Watermark DATE,
+                    Updated_At TIMESTAMP
+                )
+            """ % full_table_id
+        self.perform_sql_query_to_df(sql)
+        return full_table_id
+
+    def get_table_lock(self, full_table_id):
+        with self.table_locks_lock:
+            return self.table_locks.setdefault(full_table_id, threading.Lock())
+
     def build_table_id(self, scheme_name, table_name):
         return self.db_name + "." + scheme_name + "." + table_name
 
-    def perform_sql_query_to_df(self, sql_query):
+    def perform_sql_query_to_df(self, sql_query, query_parameters=None):
         try:
-            return self.client.query(sql_query).to_dataframe()
+            if self.query_cache is None and self.max_bytes_billed is None:
+                return self.run_query(sql_query, query_parameters)
+            dry_run_job = self.perform_dry_run(sql_query, query_parameters)
+            self.assert_query_in_budget(dry_run_job.total_bytes_processed)
+            if self.query_cache is None or dry_run_job.statement_type != "SELECT":
+                return self.run_query(sql_query, query_parameters)
+            tables_modified = [self.client.get_table(table).modified for table in dry_run_job.referenced_tables]
+            key = self.query_cache.build_key(sql_query + repr(query_parameters or []), tables_modified)
+            df = self.query_cache.get(key)
+            if df is None:
+                df = self.run_query(sql_query, query_parameters)
+                self.query_cache.put(key, df)
+            else:
+                metrics.increment("bigquery_cache_hits")
+            return df
         except Exception as ex:
             raise ex
 
+    def run_query(self, sql_query, query_parameters=None):
+        job_config = bigquery.QueryJobConfig(maximum_bytes_billed=self.max_bytes_billed,
+                                             query_parameters=query_parameters or [])
+        with metrics.span("bigquery_query") as query_span:
+            job = self.client.query(sql_query, job_config=job_config)
+            df = job.to_dataframe(bqstorage_client=self.bqstorage_client)
+            query_span.add("bigquery_rows", len(df))
+            query_span.add("bigquery_bytes_processed", job.total_bytes_processed or 0)
+            return df
+
+    def perform_dry_run(self, sql_query, query_parameters=None):
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False,
+                                             query_parameters=query_parameters or [])
+        return self.client.query(sql_query, job_config=job_config)
+
+    def get_column_types(self, full_table_id, columns):
+        """
+        :return: dict of column name -> type in the table schema, of the given columns. Empty dict for no columns.
+        """
+        if not columns:
+            return {}
+        return {field.name: field.field_type for field in self.client.get_table(full_table_id).schema
+                if field.name in columns}
+
+    def iter_streams(self, session):
+        """
+        Reads all the streams of the read session in parallel threads and yields their pages as dfs.
+        The pages are handed over through a bounded queue, so at most a few pages are held in memory.
+        """
+        pages = queue.Queue(maxsize=2 * max(1, len(session.streams)))
+        stop_event = threading.Event()
+        end_of_stream = object()
+
+        def put(item):
+            while not stop_event.is_set():
+                try:
+                    pages.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    pass
+
+        def read_stream(stream_name):
+            try:
+                for page in self.bqstorage_client.read_rows(stream_name).rows(session).pages:
+                    if stop_event.is_set():
+                        return
+                    page_df = page.to_dataframe()
+                    metrics.increment("bigquery_rows_read", len(page_df))
+                    put(page_df)
+                put(end_of_stream)
+            except Exception as ex:
+                put(ex)
+
+        threads = [threading.Thread(target=read_stream, args=(stream.name,), daemon=True) for stream in session.streams]
+        for thread in threads:
+            thread.start()
+        try:
+            remaining_streams = len(threads)
+            while remaining_streams > 0:
+                item = pages.get()
+                if item is end_of_stream:
+                    remaining_streams -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop_event.set()
+
+    def assert_query_in_budget(self, bytes_processed):
+        if self.max_bytes_billed is not None and bytes_processed > self.max_bytes_billed:
+            raise ValueError("The query would process " + str(bytes_processed) + " bytes, more than the limit of "
+                             + str(self.max_bytes_billed) + " bytes")
+
     def assert_table_is_exist(self, full_table_id):
         try:
             self.client.get_table(full_table_id)
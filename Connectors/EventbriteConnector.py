@@ -1,12 +1,108 @@
 import json
-import requests
 import pandas as pd
 from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from Connectors.HttpClient import HttpClient, TokenBucket, ResponseCache, CACHE_MODE, get_default_client
+from Connectors.Instrumentation import metrics
 
+# Eventbrite allows 2,000 calls per hour per token.
+EVENTBRITE_REQUESTS_PER_HOUR = 2000
+# endpoint regex -> seconds the cached responses are valid for. Only past events are fetched, so their attendees
+# rarely change, while the events list grows with every new event.
+EVENTBRITE_RESPONSE_TTLS = {
+    r"/attendees/$": 7 * 24 * 60 * 60,
+    r"/events/$": 60 * 60,
+}
 
-def get_request(url):
-    response = requests.request("GET", url).json()
-    return response
+
+def get_request(url, http_client=None):
+    """
+    Performs GET request and returns the json response.
+    Failed requests (429 or 5xx) are retried by the client, according to the "Retry-After" header when given.
+    :param url: the get command.
+    :param http_client: HttpClient to send the request with, None for the process wide client.
+    :return: the response as json.
+
+    :raise requests.HTTPError when the response has an error status (after the retries).
+    """
+    if http_client is None:
+        http_client = get_default_client()
+    return http_client.get_json(url)
+
+
+# The columns of the signups table, in the table order.
+SIGNUPS_TABLE_COLUMNS = [
+    "Are_you_a_she_codes__team_member_",
+    "Are_you_a_student_",
+    "Are_you_currently_a_participant_at_she_codes__",
+    "Are_you_currently_employed_",
+    "Are_you_having_a_hard_time_finding_a_job_in_high_tech_following_the_Corona_crisis_",
+    "Are_you_looking_for_a_job_in_a_technological_field_",
+    "Company",
+    "Corona_",
+    "Date",
+    "Do_you_have_a_degree_in_any_technology_related_field_",
+    "Do_you_have_an_academic_degree__if_yes__what_is_your_graduation_year_",
+    "Do_you_have_any_work_experience_in_a_technology_field_",
+    "Do_you_plan_on_beginning_your_academic_studies_this_year_",
+    "Email",
+    "Email_address_with_which_you_sign_up_for_shecodes_",
+    "Event_ID",
+    "Event_Name",
+    "From_which_branch_",
+    "Has_your_scope_of_work_or_your_salary_been_reduced_as_a_result_of_the_corona_crisis_",
+    "How_many_years_of_experience_do_you_have_",
+    "I_agree_to_receive_messages_by_Email",
+    "I_agree_to_recieve_messages_by_SMS",
+    "ID_Number",
+    "Job_Title",
+    "Order_Date",
+    "Start_Date__month___year__or_year_only_",
+    "Ticket_Type",
+    "What_degree_do_you_study_",
+    "What_field_do_you_intend_to_study_",
+    "What_is_your_estimated_graduation_year_",
+    "Which_lesson_are_you_at_",
+    "Your_track_at_she_codes_",
+]
+
+# signups table column -> the eventbrite question it holds the answer of.
+SIGNUPS_ANSWER_COLUMNS = {
+    "Are_you_looking_for_a_job_in_a_technological_field_": "Are you looking for a job in a technological field? ",
+    "Company": "Company Name",
+    "Do_you_have_an_academic_degree__if_yes__what_is_your_graduation_year_":
+        "Do you have an academic degree? if yes, what is your graduation year?",
+    "From_which_branch_": "From which branch?",
+    "Has_your_scope_of_work_or_your_salary_been_reduced_as_a_result_of_the_corona_crisis_":
+        "Has your scope of work or your salary been reduced as a result of the corona crisis?",
+    "How_many_years_of_experience_do_you_have_": "How many years of experience do you have?",
+    "Job_Title": "Job Title",
+    "What_is_your_estimated_graduation_year_": "What is your estimated graduation year? ",
+    "Which_lesson_are_you_at_": "Which lesson are you at?",
+    "Your_track_at_she_codes_": "Which Track do you study?",
+}
+
+# signups table column -> the eventbrite Yes/No question it holds the answer of (as boolean).
+SIGNUPS_BOOLEAN_ANSWER_COLUMNS = {
+    "Are_you_a_student_": "Are you  a student?",
+    "Are_you_currently_a_participant_at_she_codes__":
+        "Are you currently a participant as she codes;? (Study one of the courses?)",
+    "Are_you_currently_employed_": "Are you currently employed? ",
+    "Do_you_have_any_work_experience_in_a_technology_field_": "Do you have any work experience in a technology field?",
+    "I_agree_to_receive_messages_by_Email": "I agree to receive messages by Email",
+    "I_agree_to_recieve_messages_by_SMS": "I agree to receive messages by SMS",
+}
+
+SIGNUPS_QUESTIONS = list(dict.fromkeys(list(SIGNUPS_ANSWER_COLUMNS.values())
+                                       + list(SIGNUPS_BOOLEAN_ANSWER_COLUMNS.values())))
+
+
+def to_boolean_answer(answers):
+    """
+    :param answers: series of answers.
+    :return: series with True for "Yes", False for "No" and None for any other answer.
+    """
+    return answers.map({"Yes": True, "No": False}).astype(object).where(answers.isin(["Yes", "No"]), None)
 
 
 def check_types(arg_list, expected_types):
@@ -19,12 +115,30 @@ def check_types(arg_list, expected_types):
 
 class EventbriteConnector:
 
-    def __init__(self, json_path):
+    def __init__(self, json_path, max_workers=1, requests_per_hour=EVENTBRITE_REQUESTS_PER_HOUR,
+                 response_cache_dir=None, response_cache_mode=CACHE_MODE):
+        """
+        :param json_path: path to the json file that holds the "token" and the "organization_id".
+        :param max_workers: int represents the maximal amount of events fetched concurrently (1 means sequential).
+        :param requests_per_hour: int represents the rate limit shared by all the workers.
+        :param response_cache_dir: string represents the directory of the responses cache, None for no caching.
+        :param response_cache_mode: the cache mode (see HttpClient.ResponseCache), REPLAY_MODE serves only
+               recorded responses, without any network access.
+        """
         json_file = open(json_path)
         she_codes_parameters = json.load(json_file)
         json_file.close()
         self.token = she_codes_parameters["token"]
         self.organization_id = she_codes_parameters["organization_id"]
+        self.max_workers = max_workers
+        response_cache = None
+        if response_cache_dir is not None:
+            response_cache = ResponseCache(response_cache_dir, EVENTBRITE_RESPONSE_TTLS, mode=response_cache_mode)
+        # the quota is hourly, so the whole hour's requests may be sent at once, the API answers 429 (with
+        # Retry-After) past the hard limit.
+        self.http_client = HttpClient(pool_maxsize=max(10, max_workers),
+                                      rate_limiter=TokenBucket(requests_per_hour / 3600.0, requests_per_hour),
+                                      response_cache=response_cache)
 
     def get_arranged_events_in_time_range(self, from_date, to_date=str(date.today())):
         """
@@ -36,20 +150,44 @@ class EventbriteConnector:
         check_types([from_date, to_date], [str, str])
         return self.project_into_events_table_schema(self.get_events_in_time_range(from_date, to_date))
 
-    def get_arranged_signups_in_time_range(self, from_date, to_date=str(date.today())):
+    def get_arranged_signups_in_time_range(self, from_date, to_date=str(date.today()), max_workers=None):
         """
         Returns all the signups of events that their start date is in the interval [from_date, to_date].
         :param from_date: string represents the interval's start date, format "YYYY-MM-DD"
         :param to_date: string represents the interval's end date, format "YYYY-MM-DD".
+        :param max_workers: int represents the maximal amount of events fetched concurrently,
+               None for the connector's default.
         :return: df that contains all the signups of events in the time range, according to the table schema.
         """
         check_types([from_date, to_date], [str, str])
-        events_in_time_range = self.get_events_in_time_range(from_date, to_date)
-        signups_per_event_list = []
-        # we iterates over all the new events collecting the new signups
-        for index, row in events_in_time_range.iterrows():
-            signups_per_event_list.append(
-                self.get_event_signups_according_to_signups_table_scheme(row['id'], row['name.text'], row['start.utc']))
+        return self.get_arranged_signups_of_events(self.get_events_in_time_range(from_date, to_date), max_workers)
+
+    def get_arranged_signups_of_events(self, events_in_time_range, max_workers=None):
+        """
+        Returns all the signups of the given events.
+        :param events_in_time_range: df of the raw events, as returned by get_events_in_time_range.
+        :param max_workers: int represents the maximal amount of events fetched concurrently,
+               None for the connector's default.
+        :return: df that contains all the signups of the events, according to the table schema.
+        """
+        if max_workers is None:
+            max_workers = self.max_workers
+        # a range without events is fetched as a df without any columns.
+        if 'id' not in events_in_time_range.columns:
+            return pd.DataFrame(columns=SIGNUPS_TABLE_COLUMNS)
+        events = list(zip(events_in_time_range['id'], events_in_time_range['name.text'],
+                          events_in_time_range['start.utc']))
+        if not events:
+            return pd.DataFrame(columns=SIGNUPS_TABLE_COLUMNS)
+        # we collect the signups of all the new events, the order of the events is kept.
+        if max_workers <= 1:
+            signups_per_event_list = [self.get_event_signups_according_to_signups_table_scheme(*event)
+                                      for event in events]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                signups_per_event_list = list(
+                    executor.map(lambda event: self.get_event_signups_according_to_signups_table_scheme(*event),
+                                 events))
         large_df = pd.concat(signups_per_event_list, ignore_index=True)
         return large_df
 
@@ -62,7 +200,7 @@ class EventbriteConnector:
                       + from_date + "&start_date.range_end=" \
                       + to_date
         # Since we get the answer in paging way we call "get_all_rows"
-        all_information_df = self.get_all_rows(get_command, get_request(get_command), "events")
+        all_information_df = self.get_all_rows(get_command, get_request(get_command, self.http_client), "events")
         return all_information_df
 
     def project_into_events_table_schema(self, all_information_df):
@@ -87,74 +225,75 @@ class EventbriteConnector:
     def get_event_signups(self, event_id):
         get_command = "https://www.eventbriteapi.com/v3/events/" + event_id + "/attendees/?&token=" + self.token
         # Since we get the answer in paging way we call "get_all_rows"
-        all_signups_df = self.get_all_rows(get_command, get_request(get_command), "attendees")
+        all_signups_df = self.get_all_rows(get_command, get_request(get_command, self.http_client), "attendees")
         return all_signups_df
 
+    def iter_event_signups(self, event_id):
+        """
+        Generator over the raw signups records of the event, page by page, without building a df.
+        :param event_id: string represents the event id.
+        :return: yields the raw attendee records (json) of the event.
+        """
+        get_command = "https://www.eventbriteapi.com/v3/events/" + event_id + "/attendees/?&token=" + self.token
+        for page in self.iter_pages(get_command, get_request(get_command, self.http_client), "attendees"):
+            yield from page
+
     def get_event_signups_according_to_signups_table_scheme(self, event_id, event_name, date):
-        # todo: improve the way we retrieve the answers.
-        # todo: take the col name and the answer to be a map
         all_signups_data = self.get_event_signups(event_id)
-        new_table_data = [{"Are_you_a_she_codes__team_member_": None,
-                           "Are_you_a_student_": self.get_boolean_answer(row["answers"], "Are you  a student?"),
-                           "Are_you_currently_a_participant_at_she_codes__": self.get_boolean_answer(row["answers"],
-                                                                                                     "Are you currently a participant as she codes;? (Study one of the courses?)"),
-                           "Are_you_currently_employed_": self.get_boolean_answer(row["answers"],
-                                                                                  "Are you currently employed? "),
-                           "Are_you_having_a_hard_time_finding_a_job_in_high_tech_following_the_Corona_crisis_": None,
-                           "Are_you_looking_for_a_job_in_a_technological_field_": self.get_answer(row["answers"],
-                                                                                                  "Are you looking for a job in a technological field? "),
-                           "Company": self.get_answer(row['answers'], "Company Name"),
-                           "Corona_": self.calculate_corona(row),
-                           "Date": pd.to_datetime(date),
-                           "Do_you_have_a_degree_in_any_technology_related_field_": None,
-                           "Do_you_have_an_academic_degree__if_yes__what_is_your_graduation_year_": self.get_answer(
-                               row["answers"], "Do you have an academic degree? if yes, what is your graduation year?"),
-                           "Do_you_have_any_work_experience_in_a_technology_field_": self.get_boolean_answer(
-                               row["answers"], "Do you have any work experience in a technology field?"),
-                           "Do_you_plan_on_beginning_your_academic_studies_this_year_": None,
-                           "Email": None,
-                           "Email_address_with_which_you_sign_up_for_shecodes_": row['profile.email'],
-                           "Event_ID": int(event_id),
-                           "Event_Name": event_name,
-                           "From_which_branch_": self.get_answer(row["answers"], "From which branch?"),
-                           "Has_your_scope_of_work_or_your_salary_been_reduced_as_a_result_of_the_corona_crisis_": self.get_answer(
-                               row["answers"],
-                               "Has your scope of work or your salary been reduced as a result of the corona crisis?"),
-                           "How_many_years_of_experience_do_you_have_": self.get_answer(row["answers"],
-                                                                                        "How many years of experience do you have?"),
-                           "I_agree_to_receive_messages_by_Email": self.get_boolean_answer(row["answers"],
-                                                                                           "I agree to receive messages by Email"),
-                           "I_agree_to_recieve_messages_by_SMS": self.get_boolean_answer(row["answers"],
-                                                                                         "I agree to receive messages by SMS"),
-                           "ID_Number": None,
-                           "Job_Title": self.get_answer(row['answers'], "Job Title"),
-                           "Order_Date": pd.to_datetime(row['created']),
-                           "Start_Date__month___year__or_year_only_": None,
-                           "Ticket_Type": row['ticket_class_id'],
-                           "What_degree_do_you_study_": None,
-                           "What_field_do_you_intend_to_study_": None,
-                           "What_is_your_estimated_graduation_year_": self.get_answer(row["answers"],
-                                                                                      "What is your estimated graduation year? "),
-                           "Which_lesson_are_you_at_": self.get_answer(row['answers'], "Which lesson are you at?"),
-                           "Your_track_at_she_codes_": self.get_answer(row['answers'], "Which Track do you study?"),
-                           } for index, row in all_signups_data.iterrows()]
-
-        event_signups_df = pd.DataFrame(new_table_data)
-        return event_signups_df
-
-    def get_answer(self, all_answers, question):
-        for q in all_answers:
-            if q['question'] == question and 'answer' in q:
-                return q['answer']
-        return None
-
-    def get_boolean_answer(self, all_answers, question):
-        answer = self.get_answer(all_answers, question)
-        if answer == "Yes":
-            return True
-        if answer == "No":
-            return False
-        return None
+        return self.project_into_signups_table_schema(all_signups_data, event_id, event_name, date)
+
+    def project_into_signups_table_schema(self, all_signups_data, event_id, event_name, date):
+        """
+        Projects the raw signups of one event into the signups table schema.
+        The answers of all the attendees are extracted at once (see get_answers_table) and the columns are computed
+        as whole columns, according to SIGNUPS_ANSWER_COLUMNS and SIGNUPS_BOOLEAN_ANSWER_COLUMNS.
+        :param all_signups_data: df of the raw attendees records of the event (as returned by get_event_signups).
+        :param event_id: string represents the event id.
+        :param event_name: string represents the event name.
+        :param date: string represents the event start date.
+        :return: df that contains the signups of the event, according to the table schema.
+        """
+        if all_signups_data.empty:
+            return pd.DataFrame()
+        with metrics.span("signups_projection") as projection_span:
+            projection_span.add("signups_rows", len(all_signups_data))
+            answers = self.get_answers_table(all_signups_data["answers"])
+            index = all_signups_data.index
+            # the columns are passed as lists so their dtypes are inferred the same way as for a list of rows.
+            columns = {column: answers[question].tolist() for column, question in SIGNUPS_ANSWER_COLUMNS.items()}
+            columns.update({column: to_boolean_answer(answers[question]).tolist()
+                            for column, question in SIGNUPS_BOOLEAN_ANSWER_COLUMNS.items()})
+            columns.update({"Corona_": self.calculate_corona(answers),
+                            "Date": pd.to_datetime(date),
+                            "Email_address_with_which_you_sign_up_for_shecodes_": all_signups_data['profile.email'],
+                            "Event_ID": int(event_id),
+                            "Event_Name": event_name,
+                            "Order_Date": pd.to_datetime(all_signups_data['created']),
+                            "Ticket_Type": all_signups_data['ticket_class_id']})
+            event_signups_df = pd.DataFrame({column: columns.get(column) for column in SIGNUPS_TABLE_COLUMNS},
+                                            index=index)
+            return event_signups_df.reset_index(drop=True)
+
+    def get_answers_table(self, answers_column):
+        """
+        Arranges the answers of all the attendees as a table: a row per attendee and a column per question.
+        The answers lists are exploded once into (attendee, question, answer) rows which are pivoted to columns.
+        When a question appears more than once, the first answer is taken.
+        :param answers_column: series of the attendees' "answers" lists.
+        :return: df with the same index as answers_column and a column per question in SIGNUPS_QUESTIONS,
+                 None when the attendee did not answer.
+        """
+        exploded_answers = answers_column.explode().dropna()
+        long_answers = pd.DataFrame(exploded_answers.tolist(), index=exploded_answers.index,
+                                    columns=None if len(exploded_answers) else ["question", "answer"])
+        if "answer" not in long_answers.columns:
+            long_answers["answer"] = None
+        long_answers = long_answers[long_answers["question"].isin(SIGNUPS_QUESTIONS) & long_answers["answer"].notna()]
+        long_answers = long_answers.rename_axis("attendee").reset_index()
+        long_answers = long_answers.drop_duplicates(["attendee", "question"])
+        answers = long_answers.pivot(index="attendee", columns="question", values="answer")
+        answers = answers.reindex(index=answers_column.index, columns=SIGNUPS_QUESTIONS).astype(object)
+        return answers.where(answers.notna(), None)
 
     def get_all_rows(self, basic_get_command, json, tag_as_string):
         """
@@ -164,27 +303,43 @@ class EventbriteConnector:
         :param tag_as_string: the tag we interest in.
         :return: df with all the rows, over all the pages.
         """
-        all_information_df = pd.json_normalize(json[tag_as_string])
+        with metrics.span("eventbrite_fetch", tag=tag_as_string) as fetch_span:
+            # the df is built once at the end, concatenating per page copies all the previous pages every time.
+            all_records = [record for page in self.iter_pages(basic_get_command, json, tag_as_string)
+                           for record in page]
+            fetch_span.add("eventbrite_rows", len(all_records))
+            return pd.json_normalize(all_records)
+
+    def iter_pages(self, basic_get_command, json, tag_as_string):
+        """
+        Generator over the pages of the response, following the continuation until there are no more items.
+        :param basic_get_command: The get command.
+        :param json: the first answer.
+        :param tag_as_string: the tag we interest in.
+        :return: yields the list of raw records (according to the given tag) of every page.
+        """
+        yield json[tag_as_string]
         while json["pagination"]["has_more_items"]:
             continuation_id = json["pagination"]["continuation"]
-            json = get_request(basic_get_command + "&continuation=" + continuation_id)
-            page_df = pd.json_normalize(json[tag_as_string])
-            all_information_df = pd.concat([all_information_df, page_df], ignore_index=True)
-        return all_information_df
+            json = get_request(basic_get_command + "&continuation=" + continuation_id, self.http_client)
+            yield json[tag_as_string]
 
-    def calculate_corona(self, row):
-        student_answer = self.get_boolean_answer(row["answers"], "Are you  a student?")
-        degree_with_graduation_answer = self.get_answer(row["answers"],
-                                                        "Do you have an academic degree? if yes, what is your graduation year?")
-        estimated_graduation_answer = self.get_answer(row["answers"], "What is your estimated graduation year? ")
-        if ((student_answer is True and estimated_graduation_answer == '2021')
-                or (student_answer is False and degree_with_graduation_answer in ['2019', '2020', '2021'])):
-            return True
-
-        currently_employed_answer = self.get_boolean_answer(row["answers"], "Are you currently employed? ")
-        affected_by_corona_answer = self.get_answer(row["answers"],
-                                                    "Has your scope of work or your salary been reduced as a result of the corona crisis?")
-        if (currently_employed_answer is False or (
-                currently_employed_answer is True and affected_by_corona_answer == "Yes")):
-            return True
-        return False
+    def calculate_corona(self, answers):
+        """
+        :param answers: df of the attendees' answers, as returned by get_answers_table.
+        :return: boolean series, for every attendee whether she is considered affected by the corona crisis.
+        """
+        student_answer = to_boolean_answer(answers["Are you  a student?"])
+        degree_with_graduation_answer = answers["Do you have an academic degree? if yes, what is your graduation year?"]
+        estimated_graduation_answer = answers["What is your estimated graduation year? "]
+        currently_employed_answer = to_boolean_answer(answers["Are you currently employed? "])
+        affected_by_corona_answer = answers[
+            "Has your scope of work or your salary been reduced as a result of the corona crisis?"]
+        is_student = student_answer.eq(True)
+        is_not_student = student_answer.eq(False)
+        is_employed = currently_employed_answer.eq(True)
+        is_not_employed = currently_employed_answer.eq(False)
+        return ((is_student & estimated_graduation_answer.eq('2021'))
+                | (is_not_student & degree_with_graduation_answer.isin(['2019', '2020', '2021']))
+                | is_not_employed
+                | (is_employed & affected_by_corona_answer.eq("Yes"))).astype(bool)
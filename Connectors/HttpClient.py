@@ -0,0 +1,283 @@
+import os
+import re
+import json
+import time
+import base64
+import hashlib
+import threading
+import requests
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+from Connectors.Instrumentation import metrics
+
+DEFAULT_TIMEOUT = (5, 60)
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+# query params that hold credentials, they are not part of the cache keys.
+SECRET_QUERY_PARAMS = ["token"]
+# response cache modes: "cache" serves fresh stored responses and stores new ones, "record" always sends the request
+# and stores the response, "replay" serves only stored responses, without any network access.
+CACHE_MODE = "cache"
+RECORD_MODE = "record"
+REPLAY_MODE = "replay"
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket, used to keep the amount of requests under the API rate limit.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: float represents the amount of tokens added per second.
+        :param capacity: int represents the maximal amount of tokens (the allowed burst size).
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and consumes it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+def get_endpoint(method, url):
+    """
+    Returns the endpoint name of the url used to aggregate the stats, e.g. "GET api.zoom.us/v2/past_meetings/{id}".
+    The query string is dropped (it may hold the token) and path segments that hold ids are replaced by "{id}".
+    """
+    split_url = urlsplit(url)
+    segments = ["{id}" if re.search(r"\d", segment) and not re.fullmatch(r"v\d+", segment) else segment
+                for segment in split_url.path.split("/")]
+    return method + " " + split_url.netloc + "/".join(segments)
+
+
+def get_retries_count(response):
+    """
+    :return: the amount of retries urllib3 performed before the response.
+    """
+    retries = getattr(response.raw, "retries", None)
+    return len(retries.history) if retries is not None else 0
+
+
+def remove_secret_params(url):
+    """
+    :return: the url without the query params that hold credentials (SECRET_QUERY_PARAMS).
+    """
+    split_url = urlsplit(url)
+    query = [(name, value) for name, value in parse_qsl(split_url.query, keep_blank_values=True)
+             if name not in SECRET_QUERY_PARAMS]
+    return urlunsplit(split_url._replace(query=urlencode(query)))
+
+
+class ResponseCache:
+    """
+    On disk cache of GET responses with a TTL per endpoint, also used to record responses and replay them offline.
+    Responses are keyed by the url without its credentials, so recordings can be shared. Only successful (200)
+    responses are stored.
+    """
+
+    def __init__(self, cache_dir, ttls=None, default_ttl=0, mode=CACHE_MODE):
+        """
+        :param cache_dir: string represents the directory the responses are stored at, created when needed.
+        :param ttls: dict of endpoint regex -> the seconds a response of a matching endpoint is valid for. The regexes
+               are searched in the endpoint names (see get_endpoint), the first match is taken.
+        :param default_ttl: float represents the TTL of the endpoints that match no regex, 0 for not caching them.
+        :param mode: CACHE_MODE, RECORD_MODE or REPLAY_MODE.
+        """
+        if mode not in [CACHE_MODE, RECORD_MODE, REPLAY_MODE]:
+            raise ValueError("Illegal response cache mode " + str(mode))
+        self.cache_dir = cache_dir
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.mode = mode
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_ttl(self, endpoint):
+        for endpoint_regex, ttl in self.ttls.items():
+            if re.search(endpoint_regex, endpoint):
+                return ttl
+        return self.default_ttl
+
+    def get(self, method, url, endpoint):
+        """
+        :return: the stored requests.Response of the request, None when there is no valid one (in replay mode any
+                 stored response is valid).
+
+        :raise ValueError in replay mode, when the request was not recorded.
+        """
+        path = self.get_path(method, url)
+        if self.mode == RECORD_MODE:
+            return None
+        if not os.path.exists(path):
+            if self.mode == REPLAY_MODE:
+                raise ValueError("No recorded response for " + method + " " + remove_secret_params(url))
+            return None
+        with open(path) as cache_file:
+            entry = json.load(cache_file)
+        if self.mode == CACHE_MODE and time.time() - entry["stored_at"] > self.get_ttl(endpoint):
+            return None
+        response = requests.Response()
+        response.status_code = entry["status_code"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = base64.b64decode(entry["content"])
+        response.url = url
+        response.encoding = entry["encoding"]
+        return response
+
+    def put(self, method, url, endpoint, response):
+        if response.status_code != 200:
+            return
+        if self.mode == CACHE_MODE and self.get_ttl(endpoint) <= 0:
+            return
+        path = self.get_path(method, url)
+        entry = {"url": remove_secret_params(url),
+                 "stored_at": time.time(),
+                 "status_code": response.status_code,
+                 # the content is stored decoded, so the encoding headers don't apply to it anymore.
+                 "headers": {name: value for name, value in response.headers.items()
+                             if name.lower() not in ["content-encoding", "content-length", "transfer-encoding"]},
+                 "encoding": response.encoding,
+                 "content": base64.b64encode(response.content).decode("ascii")}
+        temp_path = path + "." + str(threading.get_ident()) + ".tmp"
+        with open(temp_path, "w") as cache_file:
+            json.dump(entry, cache_file)
+        os.replace(temp_path, path)
+
+    # ------------------------------- inner methods (not as part of the API) ------------------------------------
+
+    def get_path(self, method, url):
+        key = hashlib.sha256((method + " " + remove_secret_params(url)).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".json")
+
+
+class HttpClient:
+    """
+    Shared HTTP layer of the API connectors.
+    Holds one pooled keep-alive session with timeouts, retries with exponential backoff on 429/5xx
+    (honoring "Retry-After") and gzip compression, and collects latency and bytes counters per endpoint.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 pool_maxsize=10, rate_limiter=None, response_cache=None):
+        """
+        :param timeout: (connect, read) timeouts in seconds, or one number for both.
+        :param max_retries: int represents the maximal amount of retries of a failed request.
+        :param backoff_factor: float, the retries wait backoff_factor * 2^(retry number - 1) seconds.
+        :param pool_maxsize: int represents the amount of connections kept alive per host,
+               should be at least the amount of threads using the client.
+        :param rate_limiter: TokenBucket to acquire a token from before every request, None for no limit.
+        :param response_cache: ResponseCache to serve GET requests from, None for no caching.
+        """
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.response_cache = response_cache
+        self.session = requests.Session()
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUS_CODES,
+                      allowed_methods=None, respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        """
+        Performs the request through the pooled session.
+        :param method: string represents the HTTP method ("GET", "POST", etc.)
+        :param url: the request url.
+        :param kwargs: passed as is to requests.Session.request (headers, params, data, etc.)
+        :return: requests.Response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = get_endpoint(method, url)
+        use_cache = self.response_cache is not None and method == "GET"
+        if use_cache:
+            response = self.response_cache.get(method, url, endpoint)
+            if response is not None:
+                self.add_stats(endpoint, 0.0, 0, cache_hit=True)
+                metrics.increment("http_cache_hits", endpoint=endpoint)
+                return response
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        with metrics.span("http_request", endpoint=endpoint) as request_span:
+            start_time = time.perf_counter()
+            response = self.session.request(method, url, **kwargs)
+            self.add_stats(endpoint, time.perf_counter() - start_time, len(response.content))
+            request_span.add("http_bytes", len(response.content))
+            request_span.add("http_retries", get_retries_count(response))
+        if use_cache:
+            self.response_cache.put(method, url, endpoint, response)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def get_json(self, url, **kwargs):
+        """
+        :return: the parsed json of the GET response.
+
+        :raise requests.HTTPError when the response has an error status (after the retries were exhausted).
+        """
+        response = self.get(url, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def get_stats(self):
+        """
+        :return: dict of endpoint -> {"requests", "seconds", "bytes", "cache_hits"} with the totals since the client
+                 was created. Requests served from the response cache are counted only as cache hits.
+        """
+        with self.stats_lock:
+            return {endpoint: dict(counters) for endpoint, counters in self.stats.items()}
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {}
+
+    def close(self):
+        self.session.close()
+
+    # ------------------------------- inner methods (not as part of the API) ------------------------------------
+
+    def add_stats(self, endpoint, seconds, bytes_count, cache_hit=False):
+        with self.stats_lock:
+            counters = self.stats.setdefault(endpoint, {"requests": 0, "seconds": 0.0, "bytes": 0, "cache_hits": 0})
+            if cache_hit:
+                counters["cache_hits"] += 1
+                return
+            counters["requests"] += 1
+            counters["seconds"] += seconds
+            counters["bytes"] += bytes_count
+
+
+default_client = None
+default_client_lock = threading.Lock()
+
+
+def get_default_client():
+    """
+    :return: the process wide HttpClient, created on first use.
+    """
+    global default_client
+    with default_client_lock:
+        if default_client is None:
+            default_client = HttpClient()
+        return default_client
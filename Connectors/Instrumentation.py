@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import time
+import threading
+from datetime import datetime, timezone
+
+# when set, the instrumentation is enabled on import and the json log is written to this path ("-" for stderr).
+METRICS_LOG_ENV_VAR = "ETL_METRICS_LOG"
+METRICS_PREFIX = "etl_"
+
+
+def format_labels(labels):
+    """
+    :return: the labels in the Prometheus text format, e.g. '{endpoint="GET api.zoom.us/v2/past_meetings/{id}"}'.
+    """
+    if not labels:
+        return ""
+    escaped_labels = [(name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+                      for name, value in sorted(labels.items())]
+    return "{" + ",".join('%s="%s"' % (name, value) for name, value in escaped_labels) + "}"
+
+
+class NullSpan:
+    """
+    The span handed out while the instrumentation is disabled, does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def add(self, counter_name, value=1):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    """
+    Times a block of work. The counters added to the span get the span's labels and are written with it to the log.
+    """
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.counters = {}
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record_span(self, time.perf_counter() - self.start_time, exc_type is None)
+        return False
+
+    def add(self, counter_name, value=1):
+        """
+        Increments the counter by value, with the span's labels.
+        """
+        self.counters[counter_name] = self.counters.get(counter_name, 0) + value
+        self.metrics.increment(counter_name, value, **self.labels)
+
+
+class Metrics:
+    """
+    Collects spans (timed blocks of work) and counters, labeled by e.g. the endpoint or the table.
+    Every span is written as a json line to the log, and the totals can be exported in the Prometheus text format.
+    While disabled, span returns a shared no-op span and increment returns at once, so instrumented code pays
+    almost nothing.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.log_file = None
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.spans = {}
+
+    def enable(self, json_log_path=None):
+        """
+        :param json_log_path: string represents the file the spans are appended to as json lines, "-" for stderr,
+               None for no log (the totals are still collected).
+        """
+        with self.lock:
+            self.close_log()
+            if json_log_path == "-":
+                self.log_file = sys.stderr
+            elif json_log_path is not None:
+                self.log_file = open(json_log_path, "a")
+            self.enabled = True
+
+    def disable(self):
+        with self.lock:
+            self.enabled = False
+            self.close_log()
+
+    def span(self, name, **labels):
+        """
+        :param name: string represents the span name, e.g. "http_request".
+        :param labels: the span's labels, e.g. endpoint="...".
+        :return: context manager that times the block, NULL_SPAN when disabled.
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, labels)
+
+    def increment(self, counter_name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (counter_name, format_labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def get_counters(self):
+        """
+        :return: dict of (counter name, formatted labels) -> the counter's total.
+        """
+        with self.lock:
+            return dict(self.counters)
+
+    def get_spans(self):
+        """
+        :return: dict of (span name, formatted labels) -> {"count", "seconds", "errors", "labels"} totals.
+        """
+        with self.lock:
+            return {key: dict(totals) for key, totals in self.spans.items()}
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.spans = {}
+
+    def export_prometheus(self):
+        """
+        :return: string of all the totals in the Prometheus text exposition format. The counters are exported as
+                 etl_<name>_total, the spans as the etl_span_seconds summary (sum and count) and etl_span_errors_total.
+        """
+        lines = []
+        counters = self.get_counters()
+        for counter_name in sorted({counter_name for counter_name, _ in counters}):
+            metric_name = METRICS_PREFIX + counter_name + "_total"
+            lines.append("# TYPE %s counter" % metric_name)
+            lines.extend("%s%s %s" % (metric_name, labels, value)
+                         for (name, labels), value in sorted(counters.items()) if name == counter_name)
+        spans = self.get_spans()
+        if spans:
+            lines.append("# TYPE %sspan_seconds summary" % METRICS_PREFIX)
+            for (span_name, labels), totals in sorted(spans.items()):
+                span_labels = format_labels(dict(totals["labels"], span=span_name))
+                lines.append("%sspan_seconds_sum%s %.6f" % (METRICS_PREFIX, span_labels, totals["seconds"]))
+                lines.append("%sspan_seconds_count%s %d" % (METRICS_PREFIX, span_labels, totals["count"]))
+            lines.append("# TYPE %sspan_errors_total counter" % METRICS_PREFIX)
+            for (span_name, labels), totals in sorted(spans.items()):
+                span_labels = format_labels(dict(totals["labels"], span=span_name))
+                lines.append("%sspan_errors_total%s %d" % (METRICS_PREFIX, span_labels, totals["errors"]))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Writes the totals to the file (e.g. for the node exporter textfile collector), replacing it atomically.
+        """
+        with open(path + ".tmp", "w") as prometheus_file:
+            prometheus_file.write(self.export_prometheus())
+        os.replace(path + ".tmp", path)
+
+    # ------------------------------- inner methods (not as part of the API) ------------------------------------
+
+    def record_span(self, span, seconds, succeeded):
+        key = (span.name, format_labels(span.labels))
+        with self.lock:
+            totals = self.spans.setdefault(key, {"count": 0, "seconds": 0.0, "errors": 0, "labels": span.labels})
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            totals["errors"] += 0 if succeeded else 1
+            if self.log_file is not None:
+                self.log_file.write(json.dumps({"time": datetime.now(timezone.utc).isoformat(), "span": span.name,
+                                                "labels": span.labels, "seconds": round(seconds, 6),
+                                                "status": "ok" if succeeded else "error",
+                                                "counters": span.counters}, default=str) + "\n")
+                self.log_file.flush()
+
+    def close_log(self):
+        if self.log_file is not None and self.log_file is not sys.stderr:
+            self.log_file.close()
+        self.log_file = None
+
+
+# the process wide metrics, used by all the connectors.
+metrics = Metrics()
+if os.environ.get(METRICS_LOG_ENV_VAR):
+    metrics.enable(os.environ[METRICS_LOG_ENV_VAR])
@@ -0,0 +1,95 @@
+import os
+import re
+import time
+import hashlib
+import threading
+import pandas as pd
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 100
+
+
+def normalize_sql(sql_query):
+    """
+    :return: the query with the whitespace collapsed, so the same query written differently gets the same key.
+    """
+    return re.sub(r"\s+", " ", sql_query).strip()
+
+
+class QueryCache:
+    """
+    Local on disk cache of query results, stored as parquet files.
+    An entry is keyed on the normalized query and the last modification times of the tables it reads, so it is never
+    served after one of the tables changed. Entries expire after ttl_seconds, and when there are more than max_entries
+    the least recently used ones are removed.
+    """
+
+    def __init__(self, cache_dir, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param cache_dir: string represents the directory the results are stored at, created when needed.
+        :param ttl_seconds: float represents the time an entry is valid for since it was stored.
+        :param max_entries: int represents the maximal amount of stored results.
+        """
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def build_key(self, sql_query, tables_modified):
+        """
+        :param sql_query: string represents the query.
+        :param tables_modified: list of the last modification times of the tables the query reads.
+        :return: string represents the entry key.
+        """
+        key_source = normalize_sql(sql_query) + "|" + "|".join(sorted(str(modified) for modified in tables_modified))
+        return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        :return: the stored df of the key, or None when there is no valid entry.
+        """
+        path = self.get_path(key)
+        with self.lock:
+            if not os.path.exists(path):
+                return None
+            stored_time = os.path.getmtime(path)
+            if time.time() - stored_time > self.ttl_seconds:
+                os.remove(path)
+                return None
+            # the access time marks the use of the entry, the modification time keeps the store time.
+            os.utime(path, (time.time(), stored_time))
+            return pd.read_parquet(path)
+
+    def put(self, key, df):
+        path = self.get_path(key)
+        with self.lock:
+            df.to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            for path in self.get_entries_paths():
+                os.remove(path)
+
+    # ------------------------------- inner methods (not as part of the API) ------------------------------------
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key + ".parquet")
+
+    def get_entries_paths(self):
+        return [os.path.join(self.cache_dir, file_name) for file_name in os.listdir(self.cache_dir)
+                if file_name.endswith(".parquet")]
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for path in self.get_entries_paths():
+            if now - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+            else:
+                entries.append(path)
+        entries.sort(key=os.path.getatime)
+        for path in entries[:max(0, len(entries) - self.max_entries)]:
+            os.remove(path)
@@ -0,0 +1,179 @@
+import os
+import uuid
+import shutil
+import pandas as pd
+import pyarrow.parquet as pq
+
+PARQUET_SUFFIX = ".parquet"
+PARTITION_PREFIX = "date="
+# the partition of the rows without a date.
+NULL_PARTITION = "__null__"
+# the directory of a dataset that holds a marker file per staged date, also for the dates that have no rows.
+STAGED_DATES_DIR = "_staged_dates"
+DEFAULT_BATCH_SIZE = 50000
+
+
+def is_parquet_source(data):
+    """
+    :return: whether the data is a parquet file path or a non empty list of parquet file paths (as returned by
+             get_paths).
+    """
+    if isinstance(data, str):
+        return data.endswith(PARQUET_SUFFIX)
+    return isinstance(data, list) and len(data) > 0 and \
+        all(isinstance(path, str) and path.endswith(PARQUET_SUFFIX) for path in data)
+
+
+def iter_parquet_dfs(paths, batch_size=DEFAULT_BATCH_SIZE, columns=None):
+    """
+    :param paths: string represents a parquet file path, or list of them.
+    :param batch_size: int represents the maximal amount of rows in a df.
+    :param columns: list of strings represents the columns to read, None for all the columns.
+    :return: yields the rows of the files as dfs of up to batch_size rows, only one batch is read at a time.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    for path in paths:
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pandas()
+
+
+def get_parquet_columns(paths):
+    """
+    :return: list of the columns of the parquet files, in the order they first appear.
+    """
+    return list(dict.fromkeys(column for path in paths for column in pq.read_schema(path).names))
+
+
+def count_parquet_rows(paths):
+    """
+    :return: the amount of rows in the parquet files, read from their metadata.
+    """
+    return sum(pq.ParquetFile(path).metadata.num_rows for path in paths)
+
+
+class StagingStore:
+    """
+    Local store of extracted rows as date partitioned parquet files, between the extract and the load.
+    Every dataset is a directory with a sub directory per date: <root_dir>/<dataset>/date=YYYY-MM-DD/part-*.parquet.
+    The dates an extract covered are marked (see mark_staged), so a date that was staged without rows can be told
+    apart from a date that was never staged.
+    The loads and the transforms read the staged files (only the dates and the columns they need), so they can run
+    again without extracting from the source again.
+    """
+
+    def __init__(self, root_dir):
+        """
+        :param root_dir: string represents the directory the datasets are stored at, created when needed.
+        """
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+
+    def write(self, dataset, df, date_column):
+        """
+        Stages the rows, partitioned by the date of date_column (the UTC date for time zone aware values). The
+        partitions that get rows are replaced, so staging the extract of the same dates again does not duplicate them.
+        :param dataset: string represents the dataset name, e.g. "eventbrite_signups".
+        :param df: the rows to stage.
+        :param date_column: string represents the column the rows are partitioned by.
+        :return: list of the written files paths.
+        """
+        if df.empty:
+            return []
+        dates = pd.to_datetime(df[date_column], errors="coerce", utc=True).dt.strftime("%Y-%m-%d")
+        paths = []
+        for partition_date, partition_df in df.groupby(dates.fillna(NULL_PARTITION), sort=True):
+            partition_dir = self.get_partition_dir(dataset, partition_date)
+            shutil.rmtree(partition_dir, ignore_errors=True)
+            os.makedirs(partition_dir)
+            path = os.path.join(partition_dir, "part-" + uuid.uuid4().hex + PARQUET_SUFFIX)
+            partition_df.to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+            paths.append(path)
+        return paths
+
+    def mark_staged(self, dataset, from_date, to_date):
+        """
+        Marks the dates in the interval [from_date, to_date] as staged, whether they have rows or not.
+        :param dataset: string represents the dataset name.
+        :param from_date: string (or datetime.date) represents the interval's start date, format "YYYY-MM-DD".
+        :param to_date: string (or datetime.date) represents the interval's end date (including).
+        """
+        staged_dates_dir = os.path.join(self.root_dir, dataset, STAGED_DATES_DIR)
+        os.makedirs(staged_dates_dir, exist_ok=True)
+        for staged_date in pd.date_range(str(from_date), str(to_date)).strftime("%Y-%m-%d"):
+            open(os.path.join(staged_dates_dir, staged_date), "w").close()
+
+    def is_staged(self, dataset, from_date, to_date):
+        """
+        :return: whether all the dates in the interval [from_date, to_date] were staged (see mark_staged).
+        """
+        staged_dates_dir = os.path.join(self.root_dir, dataset, STAGED_DATES_DIR)
+        return all(os.path.exists(os.path.join(staged_dates_dir, staged_date))
+                   for staged_date in pd.date_range(str(from_date), str(to_date)).strftime("%Y-%m-%d"))
+
+    def get_dates(self, dataset):
+        """
+        :return: sorted list of the staged dates of the dataset (strings, format "YYYY-MM-DD").
+        """
+        dataset_dir = os.path.join(self.root_dir, dataset)
+        if not os.path.isdir(dataset_dir):
+            return []
+        return sorted(name[len(PARTITION_PREFIX):] for name in os.listdir(dataset_dir)
+                      if name.startswith(PARTITION_PREFIX) and name != PARTITION_PREFIX + NULL_PARTITION)
+
+    def get_paths(self, dataset, from_date=None, to_date=None):
+        """
+        :param dataset: string represents the dataset name.
+        :param from_date: string represents the interval's start date, format "YYYY-MM-DD", None for no limit.
+        :param to_date: string represents the interval's end date (including), format "YYYY-MM-DD", None for no limit.
+        :return: list of the staged files paths of the dates in the interval. The rows without a date are included
+                 only when there is no limit.
+        """
+        partition_dates = [partition_date for partition_date in self.get_dates(dataset)
+                           if (from_date is None or partition_date >= str(from_date))
+                           and (to_date is None or partition_date <= str(to_date))]
+        if from_date is None and to_date is None:
+            partition_dates.append(NULL_PARTITION)
+        paths = []
+        for partition_date in partition_dates:
+            partition_dir = self.get_partition_dir(dataset, partition_date)
+            if os.path.isdir(partition_dir):
+                paths.extend(sorted(os.path.join(partition_dir, name) for name in os.listdir(partition_dir)
+                                    if name.endswith(PARQUET_SUFFIX)))
+        return paths
+
+    def read(self, dataset, from_date=None, to_date=None, columns=None):
+        """
+        :param columns: list of strings represents the columns to read, None for all the columns.
+        :return: df of the staged rows of the dates in the interval [from_date, to_date] (see get_paths).
+        """
+        paths = self.get_paths(dataset, from_date, to_date)
+        if not paths:
+            return pd.DataFrame(columns=columns)
+        return pd.concat([pd.read_parquet(path, columns=columns) for path in paths], ignore_index=True)
+
+    def iter_batches(self, dataset, from_date=None, to_date=None, columns=None, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :return: yields the staged rows of the dates in the interval [from_date, to_date] as dfs of up to batch_size
+                 rows, so the dataset is never held in memory at once.
+        """
+        return iter_parquet_dfs(self.get_paths(dataset, from_date, to_date), batch_size, columns)
+
+    def remove(self, dataset, from_date=None, to_date=None):
+        """
+        Removes the staged rows of the dates in the interval [from_date, to_date] (see get_paths), and their marks.
+        """
+        for path in self.get_paths(dataset, from_date, to_date):
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+        staged_dates_dir = os.path.join(self.root_dir, dataset, STAGED_DATES_DIR)
+        if os.path.isdir(staged_dates_dir):
+            for staged_date in os.listdir(staged_dates_dir):
+                if (from_date is None or staged_date >= str(from_date)) and \
+                        (to_date is None or staged_date <= str(to_date)):
+                    os.remove(os.path.join(staged_dates_dir, staged_date))
+
+    # ------------------------------- inner methods (not as part of the API) ------------------------------------
+
+    def get_partition_dir(self, dataset, partition_date):
+        return os.path.join(self.root_dir, dataset, PARTITION_PREFIX + partition_date)
@@ -1,78 +1,462 @@
 import psycopg2 as pg
-import sys
+import psycopg2.pool
 import os
+import struct
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from datetime import datetime
 from configparser import ConfigParser
-from io import StringIO
 import pandas as pd
+from Connectors.Instrumentation import metrics, NULL_SPAN
+from Connectors.StagingStore import is_parquet_source, iter_parquet_dfs
+
+DEFAULT_CONFIG_FILE = './configs/database.ini'
+DEFAULT_CONFIG_SECTION = 'postgresql'
+DEFAULT_MIN_CONNECTIONS = 1
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_CHUNK_SIZE = 50000
+# the buffer size copy_expert reads the data by.
+COPY_READ_SIZE = 1 << 16
+
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+PGCOPY_TRAILER = struct.pack(">h", -1)
+POSTGRES_EPOCH = datetime(2000, 1, 1)
+# postgres type -> (struct format, size) of the fixed size types.
+BINARY_FORMATS = {"smallint": ("h", 2), "integer": ("i", 4), "bigint": ("q", 8), "real": ("f", 4),
+                  "double precision": ("d", 8), "boolean": ("?", 1)}
+INTEGER_TYPES = ["smallint", "integer", "bigint"]
+
+
+class IteratorFile:
+    """
+    Read only file object over an iterator of bytes chunks, so copy_expert can stream the data as it is produced
+    instead of reading it from one big buffer.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = bytearray()
+        # the read position in the buffer, the read bytes are dropped only when the next chunk is appended.
+        self.offset = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) - self.offset < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            del self.buffer[:self.offset]
+            self.offset = 0
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer) - self.offset
+        data = bytes(self.buffer[self.offset:self.offset + size])
+        self.offset += len(data)
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def iter_dfs(data, chunk_size):
+    """
+    :param data: df, or iterator of dfs.
+    :param chunk_size: int represents the maximal amount of rows in a chunk.
+    :return: yields the rows as dfs of up to chunk_size rows.
+    """
+    if isinstance(data, pd.DataFrame):
+        data = [data]
+    for df in data:
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+
+
+def count_rows(data, counter_span):
+    """
+    :param data: df, or iterator of dfs.
+    :param counter_span: the span to add the amount of rows to.
+    :return: yields the dfs as they are, adding their rows to the span's "postgres_rows" counter.
+    """
+    if isinstance(data, pd.DataFrame):
+        data = [data]
+    for df in data:
+        counter_span.add("postgres_rows", len(df))
+        yield df
+
+
+def iter_csv_chunks(data, chunk_size):
+    for chunk in iter_dfs(data, chunk_size):
+        # csv quoting keeps values that hold commas, quotes or new lines intact, empty values are loaded as NULL.
+        yield chunk.to_csv(header=False, index=False).encode("utf-8")
+
+
+def encode_binary_value(value, data_type):
+    """
+    Encodes one value in the postgres binary COPY format (the value's length followed by its bytes).
+    :param value: the value, None or NaN for NULL.
+    :param data_type: string represents the postgres type of the column, as in information_schema.columns.
+    :return: bytes
+
+    :raise ValueError when the type is not supported.
+    """
+    if value is None or value is pd.NaT or (isinstance(value, float) and value != value):
+        return struct.pack(">i", -1)
+    if data_type in BINARY_FORMATS:
+        value_format, size = BINARY_FORMATS[data_type]
+        if data_type in INTEGER_TYPES and isinstance(value, float):
+            # pandas holds integer columns that have missing values as floats.
+            if not value.is_integer():
+                raise ValueError("The %s column has the non integer value %s" % (data_type, value))
+            value = int(value)
+        return struct.pack(">i" + value_format, size, value)
+    if data_type in ["text", "character varying", "character"]:
+        encoded_value = str(value).encode("utf-8")
+        return struct.pack(">i", len(encoded_value)) + encoded_value
+    if data_type == "date":
+        return struct.pack(">ii", 4, (pd.Timestamp(value).date() - POSTGRES_EPOCH.date()).days)
+    if data_type in ["timestamp without time zone", "timestamp with time zone"]:
+        timestamp = pd.Timestamp(value)
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+        return struct.pack(">iq", 8, (timestamp - pd.Timestamp(POSTGRES_EPOCH)) // pd.Timedelta(microseconds=1))
+    raise ValueError("Binary copy does not support columns of type " + data_type)
+
+
+def iter_binary_chunks(data, chunk_size, column_types):
+    """
+    :param data: df, or iterator of dfs, with the table's columns in the table's order.
+    :param chunk_size: int represents the maximal amount of rows in a chunk.
+    :param column_types: list of the postgres types of the table's columns.
+    :return: yields the rows in the postgres binary COPY format, chunk by chunk.
+    """
+    yield PGCOPY_HEADER
+    tuple_header = struct.pack(">h", len(column_types))
+    for chunk in iter_dfs(data, chunk_size):
+        if len(chunk.columns) != len(column_types):
+            raise ValueError("The data has %d columns, the table has %d" % (len(chunk.columns), len(column_types)))
+        yield b"".join(tuple_header + b"".join(encode_binary_value(value, data_type)
+                                               for value, data_type in zip(row, column_types))
+                       for row in chunk.astype(object).itertuples(index=False, name=None))
+    yield PGCOPY_TRAILER
+
+
+def build_upsert_sql(target, source, column_names, key_columns):
+    """
+    :return: INSERT ... ON CONFLICT DO UPDATE statement that merges the source rows into the target, and selects
+             the amount of inserted rows and the amount of updated rows. Rows that did not change are not updated.
+    """
+    columns_list = ", ".join('"%s"' % column for column in column_names)
+    keys_list = ", ".join('"%s"' % column for column in key_columns)
+    update_columns = [column for column in column_names if column not in key_columns]
+    if update_columns:
+        conflict_action = "DO UPDATE SET %s WHERE (%s) IS DISTINCT FROM (%s)" % (
+            ", ".join('"%s" = EXCLUDED."%s"' % (column, column) for column in update_columns),
+            ", ".join('t."%s"' % column for column in update_columns),
+            ", ".join('EXCLUDED."%s"' % column for column in update_columns))
+    else:
+        conflict_action = "DO NOTHING"
+    # xmax is 0 only for the rows that were inserted (and not updated) by the statement.
+    return """
+        WITH upserted AS (
+            INSERT INTO %s AS t (%s)
+            SELECT DISTINCT ON (%s) %s FROM %s
+            ON CONFLICT (%s) %s
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+    """ % (target, columns_list, keys_list, columns_list, source, keys_list, conflict_action)
+
+
+def resolve_column_names(names, column_names):
+    """
+    :param names: list of strings represents columns of the table, as given by the caller.
+    :param column_names: list of strings represents the table's column names (from information_schema).
+    :return: the table's column names of the names: the exact name, or else the name that differs only in case (the
+             unquoted names are stored lower cased, e.g. Date is the column date).
+    """
+    resolved = []
+    for name in names:
+        matches = [column for column in column_names if column == name] or \
+                  [column for column in column_names if column.lower() == name.lower()]
+        if len(matches) != 1:
+            raise ValueError("The table has no single column %s, its columns are %s" % (name, column_names))
+        resolved.append(matches[0])
+    return resolved
+
+
+@lru_cache(maxsize=None)
+def read_config(filename=DEFAULT_CONFIG_FILE, section=DEFAULT_CONFIG_SECTION):
+    """
+    Reads the connection parameters from the config file, once per process.
+    :return: dict of the connection parameters.
+    """
+    # create a parser
+    parser = ConfigParser()
+    # read config file
+    parser.read(filename)
+
+    # get section, default to postgresql
+    if not parser.has_section(section):
+        raise Exception('Section {0} not found in the {1} file'.format(section, filename))
+    return dict(parser.items(section))
+
+
+pools = {}
+# bounds the connections in use by the pool size, so when all of them are taken the callers wait instead of failing.
+pools_semaphores = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(filename=DEFAULT_CONFIG_FILE, section=DEFAULT_CONFIG_SECTION, minconn=DEFAULT_MIN_CONNECTIONS,
+             maxconn=DEFAULT_MAX_CONNECTIONS):
+    """
+    Returns the process wide connection pool of the database, created on first use.
+    :return: psycopg2.pool.ThreadedConnectionPool
+    """
+    with pools_lock:
+        if (filename, section) not in pools:
+            print('Connecting to the PostgreSQL database...')
+            pools[(filename, section)] = pg.pool.ThreadedConnectionPool(minconn, maxconn,
+                                                                        **read_config(filename, section))
+            pools_semaphores[(filename, section)] = threading.BoundedSemaphore(maxconn)
+        return pools[(filename, section)]
+
+
+@contextmanager
+def pooled_connection(filename=DEFAULT_CONFIG_FILE, section=DEFAULT_CONFIG_SECTION):
+    """
+    Context manager that lends a connection of the pool, waiting while all the connections are in use.
+    The connection is checked only when it is handed out: a closed connection, or one that was dropped (by the server
+    or a firewall) while it was idle in the pool, is replaced, and a connection that got closed while in use is
+    discarded instead of being returned to the pool.
+    :return: psycopg2 connection.
+    """
+    connection_pool = get_pool(filename, section)
+    semaphore = pools_semaphores[(filename, section)]
+    semaphore.acquire()
+    try:
+        conn = connection_pool.getconn()
+        # every idle connection of the pool may be stale, a new connection is opened at the latest after all of them.
+        for _ in range(connection_pool.maxconn):
+            if is_connection_alive(conn):
+                break
+            connection_pool.putconn(conn, close=True)
+            conn = connection_pool.getconn()
+        try:
+            yield conn
+        finally:
+            connection_pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        semaphore.release()
+
+
+def is_connection_alive(conn):
+    """
+    :return: whether the connection is open and the server answers on it (by a cheap query).
+    """
+    if conn.closed:
+        return False
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+    except (pg.OperationalError, pg.InterfaceError):
+        return False
+    return True
+
+
+def close_pools():
+    with pools_lock:
+        for connection_pool in pools.values():
+            connection_pool.closeall()
+        pools.clear()
+        pools_semaphores.clear()
+
 
 class DBconnection:
 
-    def __init__(self):
+    def __init__(self, filename=DEFAULT_CONFIG_FILE, section=DEFAULT_CONFIG_SECTION):
+        """
+        The connections are taken from the process wide pool of the database when needed, nothing is opened here.
+        :param filename: string represents the path of the config file.
+        :param section: string represents the section of the connection parameters in the config file.
+        """
+        self.filename = filename
+        self.section = section
         self.conn = None
-        self.cur = None
-        self.connect()
-
-
-    def config(self,filename='./configs/database.ini', section='postgresql'):
-        # create a parser
-        parser = ConfigParser()
-        # read config file
-        parser.read(filename)
-
-        # get section, default to postgresql
-        db = {}
-        if parser.has_section(section):
-            params = parser.items(section)
-            for param in params:
-                db[param[0]] = param[1]
-            print(db)
-        else:
-            raise Exception('Section {0} not found in the {1} file'.format(section, filename))
+        self.held_connection = None
 
-        return db
+    def config(self):
+        return read_config(self.filename, self.section)
+
+    @contextmanager
+    def session(self):
+        """
+        Context manager that lends a pooled connection: commits when the block ends and rolls back when it raises.
+        :return: psycopg2 connection.
+        """
+        with pooled_connection(self.filename, self.section) as conn:
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
 
     def connect(self):
-        """ Connect to the PostgreSQL database server """
-        try:
-            # read connection parameters
-            params = self.config()
-            # connect to the PostgreSQL server
-            print('Connecting to the PostgreSQL database...')
-            self.conn = pg.connect(**params)
-            # create a cursor
-            self.cur = self.conn.cursor()
-            # execute a statement
-            print('PostgreSQL database version:')
-            self.cur.execute('SELECT version()')
-            # display the PostgreSQL database server version
-            db_version = self.cur.fetchone()
-            print(db_version)
-            # close the communication with the PostgreSQL
-            self.cur.close()
-        except (Exception, pg.DatabaseError) as error:
-            print(error)
+        """ Takes a connection from the pool for the direct use of self.conn, until disconnect is called """
+        if self.conn is None:
+            self.held_connection = pooled_connection(self.filename, self.section)
+            self.conn = self.held_connection.__enter__()
 
     def disconnect(self):
         if self.conn is not None:
-            self.conn.close()
+            self.held_connection.__exit__(None, None, None)
+            self.conn = None
             print("Disconnected")
 
+    def execute(self, sql, params=None):
+        """
+        Executes the statement in its own transaction.
+        :param sql: string represents the statement, with %s placeholders for the params.
+        :param params: tuple of the statement's params.
+        :return:
+        """
+        with self.session() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            cur.close()
 
-    def insert_into_db(self, df, schema,table):
-        # save dataframe to an in memory buffer
-        buffer = StringIO()
-        df.to_csv(buffer, header=False, index=False)
-        buffer.seek(0)
+    def select_into_df(self, sql, params=None):
+        """
+        :param sql: string represents the query, with %s placeholders for the params.
+        :param params: tuple of the query's params.
+        :return: df of the query's result.
+        """
+        with metrics.span("postgres_query") as query_span, self.session() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            df = pd.DataFrame(cur.fetchall(), columns=[column[0] for column in cur.description])
+            cur.close()
+            query_span.add("postgres_rows_selected", len(df))
+        return df
 
+    def insert_into_db(self, df, schema, table, chunk_size=DEFAULT_CHUNK_SIZE, binary=False):
+        """
+        Loads the rows into the table by one COPY, streaming the data chunk by chunk, so the memory it takes is
+        bounded by the chunk size and not by the data size.
+        :param df: df, iterator of dfs, string represents the path of a csv file (with a header line), or parquet
+               files paths (a path or a list, e.g. StagingStore.get_paths). The columns should be in the table's
+               columns order.
+        :param schema: string represents the schema name.
+        :param table: string represents the table name.
+        :param chunk_size: int represents the amount of rows serialized at once.
+        :param binary: whether to use the binary COPY format instead of csv (not for csv files).
+        :return: 0 on success, 1 on failure (the load is rolled back).
+        """
         try:
-            self.cur = self.conn.cursor()
-            self.cur.copy_from(buffer, schema+'.'+table, sep=",")
-            self.conn.commit()
+            with metrics.span("postgres_copy", table=schema + "." + table) as copy_span, self.session() as conn:
+                self.copy_into_table(conn, df, schema, table, schema + "." + table, chunk_size, binary, copy_span)
         except (Exception, pg.DatabaseError) as error:
             print("Error: %s" % error)
-            self.conn.rollback()
-            self.cur.close()
             return 1
-        print("copy_from_stringio() done")
-        self.cur.close()
-        return 0
\ No newline at end of file
+        print("copy_expert() done")
+        return 0
+
+    def merge_into_db(self, df, schema, table, key_columns, chunk_size=DEFAULT_CHUNK_SIZE, binary=False):
+        """
+        Upserts the rows into the table: rows whose key already exists are updated (only when they changed) and the
+        other rows are inserted, so loading the same data again changes nothing.
+        The rows are copied into a temporary staging table (like insert_into_db) and merged by one
+        INSERT ... ON CONFLICT DO UPDATE. The table must have a unique constraint on the key columns.
+        When the data holds the same key more than once, one of the rows is taken.
+        :param df: df, iterator of dfs, string represents the path of a csv file (with a header line), or parquet
+               files paths (a path or a list, e.g. StagingStore.get_paths). The columns should be in the table's
+               columns order.
+        :param schema: string represents the schema name.
+        :param table: string represents the table name.
+        :param key_columns: list of strings represents the columns that identify a row (matched to the table's
+               columns case insensitively, see resolve_column_names).
+        :param chunk_size: int represents the amount of rows serialized at once.
+        :param binary: whether to use the binary COPY format instead of csv (not for csv files).
+        :return: (amount of inserted rows, amount of updated rows), None on failure (the load is rolled back).
+        """
+        try:
+            with metrics.span("postgres_merge", table=schema + "." + table) as merge_span, self.session() as conn:
+                cur = conn.cursor()
+                # temporary tables are not written to the WAL (as unlogged tables) and are dropped on commit.
+                cur.execute("CREATE TEMP TABLE merge_staging (LIKE %s.%s INCLUDING DEFAULTS) ON COMMIT DROP"
+                            % (schema, table))
+                self.copy_into_table(conn, df, schema, table, "merge_staging", chunk_size, binary, merge_span)
+                column_names = [column_name for column_name, column_type in self.get_columns(conn, schema, table)]
+                key_columns = resolve_column_names(key_columns, column_names)
+                cur.execute(build_upsert_sql(schema + "." + table, "merge_staging", column_names, key_columns))
+                inserted, updated = cur.fetchone()
+                cur.close()
+                merge_span.add("postgres_rows_inserted", inserted)
+                merge_span.add("postgres_rows_updated", updated)
+        except (Exception, pg.DatabaseError) as error:
+            print("Error: %s" % error)
+            return None
+        print("merge done: %d inserted, %d updated" % (inserted, updated))
+        return inserted, updated
+
+    def create_unique_key(self, schema, table, key_columns):
+        """
+        Creates a unique index on the key columns of the table, if it does not exist, so the table can be merged into
+        by merge_into_db. Fails when the table already holds the same key more than once.
+        :param schema: string represents the schema name.
+        :param table: string represents the table name.
+        :param key_columns: list of strings represents the columns that identify a row (see resolve_column_names).
+        :return: 0 on success, 1 on failure.
+        """
+        try:
+            with self.session() as conn:
+                column_names = [column_name for column_name, column_type in self.get_columns(conn, schema, table)]
+                key_columns = resolve_column_names(key_columns, column_names)
+                index_name = "_".join([table] + [column.lower() for column in key_columns] + ["key"])
+                cur = conn.cursor()
+                cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS "%s" ON %s.%s (%s)' % (
+                    index_name, schema, table, ", ".join('"%s"' % column for column in key_columns)))
+                cur.close()
+        except (Exception, pg.DatabaseError) as error:
+            print("Error: %s" % error)
+            return 1
+        return 0
+
+    def copy_into_table(self, conn, df, schema, table, target, chunk_size, binary, copy_span=NULL_SPAN):
+        """
+        Copies the data into the target table, which has the columns of schema.table.
+        The amount of copied rows (or bytes, for csv files) is added to the counters of copy_span.
+        """
+        cur = conn.cursor()
+        if is_parquet_source(df):
+            # the staged files are read batch by batch, typed, instead of parsing a csv.
+            df = iter_parquet_dfs(df, chunk_size)
+        if isinstance(df, str):
+            copy_span.add("postgres_bytes", os.path.getsize(df))
+            with open(df, "rb") as csv_file:
+                cur.copy_expert("COPY %s FROM STDIN WITH (FORMAT csv, HEADER true)" % target, csv_file,
+                                size=COPY_READ_SIZE)
+        elif binary:
+            df = count_rows(df, copy_span)
+            column_types = [column_type for column_name, column_type in self.get_columns(conn, schema, table)]
+            cur.copy_expert("COPY %s FROM STDIN WITH (FORMAT binary)" % target,
+                            IteratorFile(iter_binary_chunks(df, chunk_size, column_types)), size=COPY_READ_SIZE)
+        else:
+            cur.copy_expert("COPY %s FROM STDIN WITH (FORMAT csv)" % target,
+                            IteratorFile(iter_csv_chunks(count_rows(df, copy_span), chunk_size)), size=COPY_READ_SIZE)
+        cur.close()
+
+    def get_columns(self, conn, schema, table):
+        """
+        :return: list of (name, postgres type) of the table's columns, in the table's order.
+        """
+        cur = conn.cursor()
+        cur.execute("SELECT column_name, data_type FROM information_schema.columns "
+                    "WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position", (schema, table))
+        columns = [(row[0], row[1]) for row in cur.fetchall()]
+        cur.close()
+        return columns
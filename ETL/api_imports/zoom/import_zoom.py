@@ -1,24 +1,125 @@
 from ETL import DB_Connection as dbc
 from configparser import ConfigParser
-import pandas as pd
+import argparse
 import requests
-import json
+import pandas as pd
+import os
 from datetime import datetime
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from Connectors.HttpClient import HttpClient, TokenBucket, ResponseCache, CACHE_MODE, RECORD_MODE, REPLAY_MODE
+from Connectors.Instrumentation import metrics
+from Connectors.StagingStore import StagingStore, PARQUET_SUFFIX
+from ETL.api_imports.zoom.zoom_settings import BRANCHES, ZOOM_REQUESTS_PER_SECOND
+from ETL.api_imports.zoom import zoom_analytics
+
+ZOOM_API_URL = "https://api.zoom.us/v2/"
+DEFAULT_MAX_WORKERS = 8
+# the maximal page size the Zoom list APIs allow.
+ZOOM_PAGE_SIZE = 300
+# endpoint regex -> seconds the cached responses are valid for. The details of a past meeting don't change, while the
+# meetings and instances lists grow with every new meeting.
+ZOOM_RESPONSE_TTLS = {
+    r"/past_meetings/[^/]+$": 30 * 24 * 60 * 60,
+    r"/instances$": 60 * 60,
+    r"/meetings$": 60 * 60,
+}
+
+BRANCHES_COLUMNS = ["uuid", "id", "host_id", "topic", "type", "start_time", "duration", "timezone", "created_at",
+                    "join_url", "insert_ts"]
+MEETINGS_COLUMNS = ["id", "uuid", "start_time", "insert_ts"]
+STATE_SCHEMA = "zoom"
+# the imported meeting instances details.
+MEETING_INSTANCES_TABLE = "meeting_instances"
+# the latest start time of an imported meeting instance, per branch.
+WATERMARKS_TABLE = "import_watermarks"
+# the meeting instances whose details were already imported.
+IMPORTED_MEETINGS_TABLE = "imported_meetings"
+STATE_TABLES_DDL = """
+    CREATE SCHEMA IF NOT EXISTS zoom;
+    CREATE TABLE IF NOT EXISTS zoom.import_watermarks (
+        branch TEXT PRIMARY KEY,
+        last_start_time TIMESTAMPTZ,
+        updated_at TIMESTAMPTZ
+    );
+    CREATE TABLE IF NOT EXISTS zoom.imported_meetings (
+        uuid TEXT PRIMARY KEY,
+        meeting_id BIGINT,
+        branch TEXT,
+        start_time TIMESTAMPTZ,
+        imported_at TIMESTAMPTZ
+    );
+    CREATE TABLE IF NOT EXISTS zoom.meeting_instances (
+        uuid TEXT PRIMARY KEY,
+        id BIGINT,
+        host_id TEXT,
+        topic TEXT,
+        type INTEGER,
+        user_email TEXT,
+        start_time TIMESTAMPTZ,
+        end_time TIMESTAMPTZ,
+        duration INTEGER,
+        total_minutes INTEGER,
+        participants_count INTEGER,
+        insert_ts TEXT
+    );
+"""
+IMPORTED_MEETINGS_COLUMNS = ["uuid", "meeting_id", "branch", "start_time", "imported_at"]
+MEETING_INSTANCES_FILE_PREFIX = "meeting_instances_"
+IMPORTED_MEETINGS_FILE_PREFIX = "imported_meetings_"
+# the staging store dataset of the imported meeting instances details.
+MEETING_INSTANCES_DATASET = "zoom_meeting_instances"
+
+MEETING_INSTANCES_COLUMNS = ["uuid", "id", "host_id", "topic", "type", "user_email", "start_time", "end_time",
+                             "duration", "total_minutes", "participants_count", "insert_ts"]
+
+
+def encode_meeting_uuid(uuid):
+    # Zoom requires uuids that begin with "/" or contain "//" to be encoded twice.
+    if uuid.startswith("/") or "//" in uuid:
+        return quote(quote(uuid, safe=""), safe="")
+    return quote(uuid, safe="")
+
+
+def read_staged_files(staged_files, file_prefix, columns):
+    """
+    :param staged_files: list of the staged files paths (see Zoom.stage_branch).
+    :return: df of the rows of the staged files with the given prefix.
+    """
+    staged_dfs = [pd.read_parquet(path) for path in sorted(staged_files)
+                  if os.path.basename(path).startswith(file_prefix)]
+    if not staged_dfs:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(staged_dfs, ignore_index=True)[columns]
+
 
 class Zoom:
-    def __init__(self):
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, requests_per_second=ZOOM_REQUESTS_PER_SECOND,
+                 response_cache_dir=None, response_cache_mode=CACHE_MODE, api_url=ZOOM_API_URL):
+        """
+        :param max_workers: int represents the maximal amount of requests sent concurrently.
+        :param requests_per_second: float represents the rate limit shared by all the workers.
+        :param response_cache_dir: string represents the directory of the responses cache, None for no caching.
+        :param response_cache_mode: the cache mode (see HttpClient.ResponseCache), REPLAY_MODE serves only
+               recorded responses, without any network access.
+        :param api_url: string represents the base url of the Zoom API (ends with "/").
+        """
+        self.api_url = api_url
         self.con = dbc.DBconnection()
-        self.headers = self.set_header_auth(self)
+        self.headers = self.set_header_auth()
         self.payload = {}
-        self.df_branches = pd.DataFrame(
-            columns=["uuid", "id", "host_id", "topic", "type", "start_time", "duration", "timezone", "created_at",
-                     "join_url", "insert_ts"])
-        self.df_meetings = pd.DataFrame(columns=["id", "uuid", "start_time", "insert_ts"])
-        self.df_meeting_instances = pd.DataFrame(
-            columns=["uuid", "id", "host_id", "topic", "type", "user_email", "start_time", "end_time", "duration",
-                     "total_minutes", "participants_count", "insert_ts"])
-
-        self.branches = ["10", "20", "30", "40", "50", "60", "70", "80", "90", "100", "200", "300"]
+        self.max_workers = max_workers
+        response_cache = None
+        if response_cache_dir is not None:
+            response_cache = ResponseCache(response_cache_dir, ZOOM_RESPONSE_TTLS, mode=response_cache_mode)
+        self.http_client = HttpClient(pool_maxsize=max(10, max_workers),
+                                      rate_limiter=TokenBucket(requests_per_second, requests_per_second),
+                                      response_cache=response_cache)
+        self.df_branches = pd.DataFrame(columns=BRANCHES_COLUMNS)
+        self.df_meetings = pd.DataFrame(columns=MEETINGS_COLUMNS)
+        self.df_meeting_instances = pd.DataFrame(columns=MEETING_INSTANCES_COLUMNS)
+
+        self.branches = list(BRANCHES)
         # branches = ["10"]
 
     def set_header_auth(self):
@@ -26,13 +127,8 @@ class Zoom:
         parser = ConfigParser()
         # read config file
         parser.read('./configs/zoom.ini')
-        headers = {}
         if parser.has_section('Auth'):
-            params = parser.items('Auth')
-            for param in params:
-                headers[param[0]] = param[1]
-            print(headers)
-            return headers
+            return dict(parser.items('Auth'))
         else:
             raise Exception('Section {0} not found in the file'.format('Auth'))
 
@@ -41,66 +137,300 @@ class Zoom:
             return dict[time_value]
         return '1970-01-01 00:00:00'
 
-    def get_meetings(self):
-        for branch in self.branches:
-            url = "https://api.zoom.us/v2/users/branch" + branch + "@she-codes.org/meetings?page_size=50"
-            response = requests.request("GET", url, headers=self.headers, data=self.payload).text
-            meetings = json.loads(response)["meetings"]
-            for meeting in meetings:
-                # print(meeting)
-                df_branches = df_branches.append({
-                    "uuid": meeting["uuid"],
-                    "id": meeting["id"],
-                    "host_id": meeting["host_id"],
-                    "topic": meeting["topic"],
-                    "type": meeting["type"],
-                    "start_time": meeting["start_time"],
-                    "duration": meeting["duration"],
-                    "timezone": meeting["timezone"],
-                    "created_at": meeting["created_at"],
-                    "join_url": meeting["join_url"],
-                    "insert_ts": datetime.utcnow().strftime("%d-%m-%Y %H:%M:%S")
-                }, ignore_index=True)
-            # df = pd.read_json(json.loads(response)["meetings"])
-        print(df_branches)
-        for branch in df_branches["id"]:
-            url = "https://api.zoom.us/v2/past_meetings/" + str(branch) + "/instances"
-
-            response = requests.request("GET", url, headers=self.headers, data=self.payload).text
-            meetings = json.loads(response)
-            if "meetings" in json.loads(response).keys() and json.loads(response)["meetings"] != []:
-                meetings = json.loads(response)["meetings"]
-                for meeting in meetings:
-                    # print(meeting)
-                    df_meetings = df_meetings.append({
-                        "id": branch,
-                        "uuid": meeting["uuid"],
-                        "start_time": meeting["start_time"],
-                        "insert_ts": datetime.utcnow().strftime("%d-%m-%Y %H:%M:%S")
-                    }, ignore_index=True)
-
-        print(df_meetings)
-
-    for meeting in df_meetings["uuid"]:
-        url = "https://api.zoom.us/v2/past_meetings/" + meeting
-
-        response = requests.request("GET", url, headers=headers, data=payload).text
-        meeting_instances = json.loads(response)
-        print(meeting_instances)
-        if "uuid" in meeting_instances.keys():
-            df_meeting_instances = df_meeting_instances.append({
-                "id": meeting_instances["id"],
-                "uuid": meeting_instances["uuid"],
-                "host_id": meeting_instances["host_id"],
-                "topic": meeting_instances["topic"],
-                "type": meeting_instances["type"],
-                "user_email": meeting_instances["user_email"],
-                "start_time": does_exists_time("start_time", meeting_instances),
-                "end_time": does_exists_time("end_time", meeting_instances),
-                "duration": meeting_instances["duration"],
-                "total_minutes": meeting_instances["total_minutes"],
-                "participants_count": meeting_instances["participants_count"],
-                "insert_ts": datetime.utcnow().strftime("%d-%m-%Y %H:%M:%S")
-            }, ignore_index=True)
-
-    df_meeting_instances.to_csv(r'meetings_she_codes.csv', encoding='utf-8-sig')
\ No newline at end of file
+    def get_meetings(self, full_refresh=False, staging_store=None):
+        """
+        Imports the meetings of all the branches, their past instances and the details of the new instances, loads the
+        details into the meeting instances table and saves them to "meetings_she_codes.csv" (and to the staging store,
+        partitioned by their start date).
+        An instance is new when its uuid was not imported before and it started after the latest imported instance of
+        its branch (the branch's watermark). Both are kept in the state tables and updated after the load, so
+        ended meetings, which never change, are fetched once.
+        :param full_refresh: whether to ignore the state and fetch the details of all the instances.
+        :param staging_store: StagingStore the details are staged in, None for no staging.
+        :return: df of the details of the imported meeting instances.
+        """
+        df_meeting_instances, imported_meetings = self.fetch_new_meetings(self.branches, full_refresh)
+        df_meeting_instances.to_csv(r'meetings_she_codes.csv', encoding='utf-8-sig')
+        if staging_store is not None:
+            staging_store.write(MEETING_INSTANCES_DATASET, df_meeting_instances, "start_time")
+        self.load_meeting_instances(df_meeting_instances, imported_meetings)
+        return df_meeting_instances
+
+    def stage_branch(self, branch, staging_dir, full_refresh=False):
+        """
+        Fetches the new meeting instances of one branch into parquet files in the staging directory, to be loaded by
+        load_staged. The state is not updated until they are loaded.
+        :param branch: string represents the branch number.
+        :param staging_dir: string represents the directory the files are written to, created when needed.
+        :param full_refresh: whether to ignore the state and fetch the details of all the instances.
+        :return: list of the written files paths.
+        """
+        df_meeting_instances, imported_meetings = self.fetch_new_meetings([branch], full_refresh)
+        os.makedirs(staging_dir, exist_ok=True)
+        paths = [os.path.join(staging_dir, MEETING_INSTANCES_FILE_PREFIX + branch + PARQUET_SUFFIX),
+                 os.path.join(staging_dir, IMPORTED_MEETINGS_FILE_PREFIX + branch + PARQUET_SUFFIX)]
+        df_meeting_instances.to_parquet(paths[0], index=False)
+        imported_meetings.to_parquet(paths[1], index=False)
+        return paths
+
+    def load_staged(self, staged_files):
+        """
+        Loads the meeting instances staged by stage_branch (of all the branches) by one merge into the meeting
+        instances table, updates the weekly attendance rollup of their weeks, and then updates the state.
+        :param staged_files: list of the files paths returned by stage_branch, of all the branches.
+        :return: (amount of inserted rows, amount of updated rows)
+
+        :raise FileNotFoundError when a staged file is missing, e.g. when the staging dir is not shared by the hosts.
+        """
+        missing_files = [path for path in staged_files if not os.path.exists(path)]
+        if missing_files:
+            raise FileNotFoundError("The staged files are missing: " + str(missing_files))
+        df_meeting_instances = read_staged_files(staged_files, MEETING_INSTANCES_FILE_PREFIX, MEETING_INSTANCES_COLUMNS)
+        imported_meetings = read_staged_files(staged_files, IMPORTED_MEETINGS_FILE_PREFIX, IMPORTED_MEETINGS_COLUMNS)
+        return self.load_meeting_instances(df_meeting_instances, imported_meetings)
+
+    def load_meeting_instances(self, df_meeting_instances, imported_meetings):
+        """
+        Merges the meeting instances into the meeting instances table, updates the weekly attendance rollup of their
+        weeks, and only then updates the state, so a failed load is fetched again by the next import.
+        :param df_meeting_instances: df of the details of the new instances.
+        :param imported_meetings: df of the state rows of the new instances (see fetch_new_meetings).
+        :return: (amount of inserted rows, amount of updated rows)
+        """
+        self.create_state_tables()
+        merge_result = self.con.merge_into_db(df_meeting_instances, STATE_SCHEMA, MEETING_INSTANCES_TABLE, ["uuid"])
+        if merge_result is None:
+            raise Exception("Loading the meeting instances failed")
+        if zoom_analytics.update_weekly_rollup(self.con, df_meeting_instances) is None:
+            raise Exception("Updating the weekly attendance rollup failed")
+        self.save_state(imported_meetings)
+        return merge_result
+
+    def fetch_new_meetings(self, branches, full_refresh=False):
+        """
+        Fetches the meetings of the branches, their past instances and the details of the new instances.
+        The requests of every stage are sent concurrently (bounded by max_workers and the rate limit), and every df
+        is built once from the collected records.
+        :param branches: list of strings represents the branches numbers.
+        :param full_refresh: whether to ignore the state and fetch the details of all the instances.
+        :return: (df of the details of the new instances, df of the state rows of the new instances). The instances
+                 whose details were not found have a state row without imported_at.
+        """
+        insert_ts = datetime.utcnow().strftime("%d-%m-%Y %H:%M:%S")
+        with metrics.span("zoom_fetch", stage="meetings") as meetings_span:
+            branches_meetings = self.map_concurrently(self.get_branch_meetings, branches)
+            self.df_branches = pd.DataFrame([dict(meeting, insert_ts=insert_ts)
+                                             for meetings in branches_meetings for meeting in meetings],
+                                            columns=BRANCHES_COLUMNS)
+            meetings_span.add("zoom_rows", len(self.df_branches))
+        print(self.df_branches)
+
+        meeting_branches = {meeting["id"]: branch
+                            for branch, meetings in zip(branches, branches_meetings) for meeting in meetings}
+        meeting_ids = list(self.df_branches["id"])
+        with metrics.span("zoom_fetch", stage="instances") as instances_span:
+            meetings_instances = self.map_concurrently(self.get_meeting_instances, meeting_ids)
+            self.df_meetings = pd.DataFrame([{"id": meeting_id, "uuid": instance["uuid"],
+                                              "start_time": instance["start_time"], "insert_ts": insert_ts}
+                                             for meeting_id, instances in zip(meeting_ids, meetings_instances)
+                                             for instance in instances],
+                                            columns=MEETINGS_COLUMNS)
+            instances_span.add("zoom_rows", len(self.df_meetings))
+        print(self.df_meetings)
+
+        new_meetings = self.df_meetings
+        if not full_refresh:
+            new_meetings = self.filter_new_meetings(self.df_meetings, meeting_branches)
+        print("Fetching the details of %d out of %d meeting instances" % (len(new_meetings), len(self.df_meetings)))
+
+        with metrics.span("zoom_fetch", stage="details") as details_span:
+            meetings_details = self.map_concurrently(self.get_meeting_details, list(new_meetings["uuid"]))
+            self.df_meeting_instances = pd.DataFrame([self.project_meeting_details(details, insert_ts)
+                                                      for details in meetings_details if details is not None],
+                                                     columns=MEETING_INSTANCES_COLUMNS)
+            details_span.add("zoom_rows", len(self.df_meeting_instances))
+        is_imported = new_meetings["uuid"].isin(set(self.df_meeting_instances["uuid"]))
+        imported_meetings_state = pd.DataFrame({"uuid": new_meetings["uuid"],
+                                                "meeting_id": new_meetings["id"],
+                                                "branch": new_meetings["id"].map(meeting_branches),
+                                                "start_time": pd.to_datetime(new_meetings["start_time"], utc=True),
+                                                "imported_at": pd.Series(pd.Timestamp.now(tz="UTC"),
+                                                                         index=new_meetings.index).where(is_imported)},
+                                               columns=IMPORTED_MEETINGS_COLUMNS)
+        return self.df_meeting_instances, imported_meetings_state
+
+    def filter_new_meetings(self, df_meetings, meeting_branches):
+        """
+        :param df_meetings: df of the meeting instances (id, uuid, start_time).
+        :param meeting_branches: dict of meeting id -> the branch of the meeting.
+        :return: the instances that were not imported before and started after their branch's watermark.
+        """
+        self.create_state_tables()
+        imported_uuids = set(self.con.select_into_df("SELECT uuid FROM %s.%s" % (STATE_SCHEMA, IMPORTED_MEETINGS_TABLE))
+                             ["uuid"])
+        watermarks = self.con.select_into_df("SELECT branch, last_start_time FROM %s.%s"
+                                             % (STATE_SCHEMA, WATERMARKS_TABLE))
+        branches_watermarks = dict(zip(watermarks["branch"], pd.to_datetime(watermarks["last_start_time"], utc=True)))
+        start_times = pd.to_datetime(df_meetings["start_time"], utc=True)
+        watermark_per_meeting = pd.to_datetime(df_meetings["id"].map(meeting_branches).map(branches_watermarks),
+                                               utc=True)
+        is_after_watermark = watermark_per_meeting.isna() | (start_times > watermark_per_meeting)
+        return df_meetings[~df_meetings["uuid"].isin(imported_uuids) & is_after_watermark]
+
+    def save_state(self, imported_meetings_state):
+        """
+        Records the imported instances and moves the watermarks of their branches to their latest start time, but not
+        past the oldest instance of the branch whose details were not found, so it is fetched again by the next import
+        (the imported instances after it are skipped by their uuid).
+        :param imported_meetings_state: df of the state rows of the new instances (IMPORTED_MEETINGS_COLUMNS), the
+               instances whose details were not found have no imported_at.
+        :return:
+        """
+        imported_meetings_state = imported_meetings_state.assign(
+            start_time=pd.to_datetime(imported_meetings_state["start_time"], utc=True))
+        is_imported = imported_meetings_state["imported_at"].notna()
+        failed_meetings = imported_meetings_state[~is_imported]
+        imported_meetings_state = imported_meetings_state[is_imported]
+        if not failed_meetings.empty:
+            print("The details of %d meeting instances were not found, they will be fetched again"
+                  % len(failed_meetings))
+        if imported_meetings_state.empty:
+            return
+        self.create_state_tables()
+        now = pd.Timestamp.now(tz="UTC")
+        self.con.merge_into_db(imported_meetings_state, STATE_SCHEMA, IMPORTED_MEETINGS_TABLE, ["uuid"])
+        oldest_failed_start_times = failed_meetings.groupby("branch")["start_time"].min()
+        watermark_limits = pd.to_datetime(imported_meetings_state["branch"].map(oldest_failed_start_times), utc=True)
+        before_failed = watermark_limits.isna() | (imported_meetings_state["start_time"] < watermark_limits)
+        watermarks = imported_meetings_state[before_failed].groupby("branch", as_index=False)["start_time"].max()
+        if watermarks.empty:
+            return
+        watermarks = watermarks.rename(columns={"start_time": "last_start_time"}).assign(updated_at=now)
+        # the watermark never moves back, a late import of an older instance keeps the newer watermark.
+        current_watermarks = self.con.select_into_df("SELECT branch, last_start_time FROM %s.%s"
+                                                     % (STATE_SCHEMA, WATERMARKS_TABLE))
+        current_watermarks = dict(zip(current_watermarks["branch"],
+                                      pd.to_datetime(current_watermarks["last_start_time"], utc=True)))
+        watermarks["last_start_time"] = [max(start_time, current_watermarks.get(branch, start_time))
+                                         for branch, start_time in zip(watermarks["branch"],
+                                                                       watermarks["last_start_time"])]
+        self.con.merge_into_db(watermarks, STATE_SCHEMA, WATERMARKS_TABLE, ["branch"])
+
+    def create_state_tables(self):
+        self.con.execute(STATE_TABLES_DDL)
+
+    def get_branch_meetings(self, branch):
+        """
+        :param branch: string represents the branch number.
+        :return: list of the branch's meetings records.
+        """
+        return list(self.iter_branch_meetings(branch))
+
+    def iter_branch_meetings(self, branch):
+        """
+        Generator over all the branch's meetings records, page by page.
+        :param branch: string represents the branch number.
+        :return: yields the meetings records.
+        """
+        url = self.api_url + "users/branch" + branch + "@she-codes.org/meetings"
+        return self.iter_pages(url, "meetings")
+
+    def iter_pages(self, url, tag_as_string):
+        """
+        Generator over the records of a paginated Zoom list API, following "next_page_token" until the last page.
+        Only one page is held at a time.
+        :param url: the list API url, without query string.
+        :param tag_as_string: the tag of the records in the response.
+        :return: yields the records (according to the given tag) of all the pages.
+
+        :raise requests.HTTPError or ValueError when a response is an error or has no such tag.
+        """
+        next_page_token = ""
+        while True:
+            page_url = url + "?page_size=" + str(ZOOM_PAGE_SIZE)
+            if next_page_token:
+                page_url += "&next_page_token=" + quote(next_page_token, safe="")
+            json = self.get_json(page_url)
+            if tag_as_string not in json:
+                # an error body, not an empty page: failing lets the branch be retried instead of importing nothing.
+                raise ValueError("The response of %s has no %s: %s" % (url, tag_as_string, json))
+            yield from json[tag_as_string]
+            next_page_token = json.get("next_page_token", "")
+            if not next_page_token:
+                return
+
+    def get_meeting_instances(self, meeting_id):
+        """
+        :param meeting_id: the meeting id.
+        :return: list of the meeting's past instances records (uuid and start_time).
+        """
+        url = self.api_url + "past_meetings/" + str(meeting_id) + "/instances"
+        json = self.get_json(url)
+        if "meetings" not in json:
+            raise ValueError("The response of %s has no meetings: %s" % (url, json))
+        return json["meetings"]
+
+    def get_meeting_details(self, uuid):
+        """
+        :param uuid: string represents the meeting instance uuid.
+        :return: the details record of the instance, None when it was not found.
+        """
+        try:
+            meeting_details = self.get_json(self.api_url + "past_meetings/" + encode_meeting_uuid(uuid))
+        except requests.HTTPError as error:
+            if error.response.status_code == 404:
+                return None
+            raise
+        if "uuid" not in meeting_details:
+            return None
+        return meeting_details
+
+    def project_meeting_details(self, meeting_details, insert_ts):
+        return {"id": meeting_details["id"],
+                "uuid": meeting_details["uuid"],
+                "host_id": meeting_details["host_id"],
+                "topic": meeting_details["topic"],
+                "type": meeting_details["type"],
+                "user_email": meeting_details["user_email"],
+                "start_time": self.does_exists_time("start_time", meeting_details),
+                "end_time": self.does_exists_time("end_time", meeting_details),
+                "duration": meeting_details["duration"],
+                "total_minutes": meeting_details["total_minutes"],
+                "participants_count": meeting_details["participants_count"],
+                "insert_ts": insert_ts}
+
+    # ------------------------------- inner methods (not as part of the API) ------------------------------------
+
+    def get_json(self, url):
+        # the response is parsed once, by the client.
+        return self.http_client.get_json(url, headers=self.headers, data=self.payload)
+
+    def map_concurrently(self, func, items):
+        """
+        :return: list of func's results over the items, in the items order.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(func, items))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Imports the Zoom meetings of all the branches")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="ignore the import state and fetch the details of all the meeting instances")
+    parser.add_argument("--response-cache-dir",
+                        help="cache the API responses in this directory")
+    parser.add_argument("--response-cache-mode", choices=[CACHE_MODE, RECORD_MODE, REPLAY_MODE], default=CACHE_MODE,
+                        help="record the API responses, or replay the recorded ones without any network access")
+    parser.add_argument("--metrics-log", help="write the timing spans as json lines to this file (\"-\" for stderr)")
+    parser.add_argument("--prometheus-file", help="write the metrics totals in the Prometheus text format to this file")
+    parser.add_argument("--staging-dir", help="stage the meeting instances as date partitioned parquet files in this "
+                                              "directory")
+    args = parser.parse_args()
+    if args.metrics_log or args.prometheus_file:
+        metrics.enable(args.metrics_log)
+    staging_store = None if args.staging_dir is None else StagingStore(args.staging_dir)
+    Zoom(response_cache_dir=args.response_cache_dir,
+         response_cache_mode=args.response_cache_mode).get_meetings(full_refresh=args.full_refresh,
+                                                                    staging_store=staging_store)
+    if args.prometheus_file:
+        metrics.write_prometheus(args.prometheus_file)
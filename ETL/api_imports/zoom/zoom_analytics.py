@@ -0,0 +1,193 @@
+"""
+Attendance analytics over the imported Zoom meeting instances (the zoom.meeting_instances table, or an export such as
+meetings_she_codes.csv): sessions, participants, duration and minutes per branch, topic and week, and the sessions of a
+branch that overlap each other.
+The weekly rollup holds only additive columns (sums and counts), so it can be summarized by any of its keys and
+updated week by week: every import recomputes only the weeks of its meeting instances and merges them into the
+zoom.weekly_attendance table. The averages are derived when summarizing.
+
+    python -m ETL.api_imports.zoom.zoom_analytics --meetings-csv ETL/meetings.csv --by branch week_start
+    python -m ETL.api_imports.zoom.zoom_analytics --rebuild
+"""
+import argparse
+import numpy as np
+import pandas as pd
+
+ROLLUP_SCHEMA = "zoom"
+ROLLUP_TABLE = "weekly_attendance"
+ROLLUP_KEY_COLUMNS = ["branch", "topic", "week_start"]
+# the additive columns of the rollup, summed when summarizing by fewer keys.
+ROLLUP_SUM_COLUMNS = ["sessions", "participants", "duration_minutes", "total_minutes", "overlapping_sessions"]
+ROLLUP_COLUMNS = ROLLUP_KEY_COLUMNS + ROLLUP_SUM_COLUMNS
+ROLLUP_TABLE_DDL = """
+    CREATE SCHEMA IF NOT EXISTS zoom;
+    CREATE TABLE IF NOT EXISTS zoom.weekly_attendance (
+        branch TEXT,
+        topic TEXT,
+        week_start DATE,
+        sessions INTEGER,
+        participants BIGINT,
+        duration_minutes BIGINT,
+        total_minutes BIGINT,
+        overlapping_sessions INTEGER,
+        PRIMARY KEY (branch, topic, week_start)
+    );
+"""
+MEETING_INSTANCES_QUERY = """
+    SELECT topic, user_email, start_time, end_time, duration, total_minutes, participants_count
+    FROM zoom.meeting_instances
+"""
+# the importer sets this time when Zoom does not return one.
+MISSING_TIME = pd.Timestamp("1970-01-01", tz="UTC")
+BRANCH_EMAIL_PATTERN = r"(?i)^branch(\w+)@"
+
+
+def prepare_meetings(df_meetings):
+    """
+    :param df_meetings: df of meeting instances (topic, user_email, start_time, end_time, duration, and optionally
+           total_minutes and participants_count).
+    :return: df of the instances that have a start time, with UTC start and end times, the branch (from the host's
+             email) and the week_start (the Monday of the start time's week).
+    """
+    start_times = pd.to_datetime(df_meetings["start_time"], utc=True, errors="coerce")
+    end_times = pd.to_datetime(df_meetings["end_time"], utc=True, errors="coerce")
+    durations = pd.to_numeric(df_meetings["duration"], errors="coerce")
+    # an instance without an end time lasted its duration.
+    end_times = end_times.mask(end_times.isna() | (end_times == MISSING_TIME),
+                               start_times + pd.to_timedelta(durations, unit="m"))
+    branches = df_meetings["user_email"].str.extract(BRANCH_EMAIL_PATTERN, expand=False)
+    meetings = pd.DataFrame({
+        "branch": branches.fillna(df_meetings["user_email"]),
+        "topic": df_meetings["topic"],
+        "start_time": start_times,
+        "end_time": end_times,
+        "duration": durations,
+        "total_minutes": pd.to_numeric(df_meetings.get("total_minutes", np.nan), errors="coerce"),
+        "participants_count": pd.to_numeric(df_meetings.get("participants_count", np.nan), errors="coerce"),
+    }, index=df_meetings.index)
+    meetings = meetings[meetings["start_time"].notna() & (meetings["start_time"] != MISSING_TIME)]
+    start_days = meetings["start_time"].dt.floor("D")
+    week_starts = start_days - pd.to_timedelta(start_days.dt.dayofweek, unit="D")
+    return meetings.assign(week_start=week_starts.dt.date)
+
+
+def flag_overlapping_sessions(meetings):
+    """
+    Finds the sessions of a branch that overlap another session of the same branch, by one sweep over the sessions
+    sorted by their start time: a session overlaps an earlier one when it starts before the latest end of the
+    sessions before it, and a later one when it ends after the next session starts.
+    :param meetings: df of prepared meeting instances (see prepare_meetings).
+    :return: boolean series (by the meetings' index) of whether the session overlaps another one.
+    """
+    if meetings.empty:
+        return pd.Series(False, index=meetings.index)
+    ordered = meetings.sort_values(["branch", "start_time"], kind="mergesort")
+    branch_codes = pd.factorize(ordered["branch"])[0]
+    starts = ordered["start_time"].to_numpy(dtype="datetime64[ns]")
+    ends = ordered["end_time"].to_numpy(dtype="datetime64[ns]")
+    is_new_branch = np.r_[True, branch_codes[1:] != branch_codes[:-1]]
+    is_last_of_branch = np.r_[is_new_branch[1:], True]
+    # the latest end of the branch's sessions up to every session (a missing end never overlaps).
+    latest_ends = ordered["end_time"].groupby(branch_codes).cummax().to_numpy(dtype="datetime64[ns]")
+    previous_latest_ends = np.r_[np.datetime64("NaT", "ns"), latest_ends[:-1]]
+    next_starts = np.r_[starts[1:], np.datetime64("NaT", "ns")]
+    overlaps_previous = ~is_new_branch & (starts < previous_latest_ends)
+    overlaps_next = ~is_last_of_branch & (ends > next_starts)
+    return pd.Series(overlaps_previous | overlaps_next, index=ordered.index).reindex(meetings.index)
+
+
+def compute_weekly_rollup(meetings):
+    """
+    :param meetings: df of prepared meeting instances (see prepare_meetings).
+    :return: df of the rollup columns, a row per branch, topic and week.
+    """
+    if meetings.empty:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    meetings = meetings.assign(overlapping=flag_overlapping_sessions(meetings))
+    rollup = meetings.groupby(ROLLUP_KEY_COLUMNS, sort=True).agg(
+        sessions=("start_time", "size"),
+        participants=("participants_count", "sum"),
+        duration_minutes=("duration", "sum"),
+        total_minutes=("total_minutes", "sum"),
+        overlapping_sessions=("overlapping", "sum"))
+    return rollup.reset_index()[ROLLUP_COLUMNS].astype({column: "int64" for column in ROLLUP_SUM_COLUMNS})
+
+
+def summarize_rollup(rollup, by):
+    """
+    Sums the rollup by some of its keys and adds the average duration of a session, the average participants of a
+    session and the minutes per participant.
+    :param rollup: df of the rollup columns (see compute_weekly_rollup).
+    :param by: list of strings represents the keys to summarize by, e.g. ["branch"] or ["topic", "week_start"].
+    :return: df of the keys, the sums and the averages.
+    """
+    unknown_keys = set(by) - set(ROLLUP_KEY_COLUMNS)
+    if unknown_keys:
+        raise ValueError("Illegal keys " + str(sorted(unknown_keys)) + ", expected some of " + str(ROLLUP_KEY_COLUMNS))
+    summary = rollup.groupby(by, sort=True)[ROLLUP_SUM_COLUMNS].sum().reset_index()
+    sessions = summary["sessions"].to_numpy(dtype=float)
+    participants = summary["participants"].to_numpy(dtype=float)
+    # the exports without total_minutes sum it to 0, which has no minutes per participant.
+    has_minutes = (participants > 0) & (summary["total_minutes"].to_numpy() > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        summary["average_duration"] = np.where(sessions > 0, summary["duration_minutes"] / sessions, np.nan)
+        summary["average_participants"] = np.where(sessions > 0, participants / sessions, np.nan)
+        summary["minutes_per_participant"] = np.where(has_minutes, summary["total_minutes"] / participants, np.nan)
+    return summary
+
+
+def update_weekly_rollup(con, df_meeting_instances):
+    """
+    Recomputes the rollup of the weeks of the given meeting instances from the meeting instances table (which should
+    already hold them) and merges it into the rollup table, so the other weeks are not read again.
+    :param con: DB_Connection.DBconnection
+    :param df_meeting_instances: df of the newly imported meeting instances.
+    :return: (amount of inserted rows, amount of updated rows), None on failure.
+    """
+    weeks = set(prepare_meetings(df_meeting_instances)["week_start"])
+    if not weeks:
+        return 0, 0
+    from_time = pd.Timestamp(min(weeks), tz="UTC")
+    to_time = pd.Timestamp(max(weeks), tz="UTC") + pd.Timedelta(days=7)
+    # the day before the first week is read too, so the sessions that overlap from it are detected.
+    query = MEETING_INSTANCES_QUERY + "WHERE start_time >= %s AND start_time < %s"
+    meetings = prepare_meetings(con.select_into_df(query, (from_time - pd.Timedelta(days=1), to_time)))
+    rollup = compute_weekly_rollup(meetings)
+    rollup = rollup[rollup["week_start"].isin(weeks)]
+    print("Updating the attendance rollup of %d weeks" % len(weeks))
+    con.execute(ROLLUP_TABLE_DDL)
+    return con.merge_into_db(rollup, ROLLUP_SCHEMA, ROLLUP_TABLE, ROLLUP_KEY_COLUMNS)
+
+
+def rebuild_weekly_rollup(con):
+    """
+    Recomputes the rollup of all the weeks from the meeting instances table.
+    :param con: DB_Connection.DBconnection
+    :return: (amount of inserted rows, amount of updated rows), None on failure.
+    """
+    rollup = compute_weekly_rollup(prepare_meetings(con.select_into_df(MEETING_INSTANCES_QUERY)))
+    con.execute(ROLLUP_TABLE_DDL)
+    return con.merge_into_db(rollup, ROLLUP_SCHEMA, ROLLUP_TABLE, ROLLUP_KEY_COLUMNS)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Zoom attendance analytics by branch, topic and week")
+    parser.add_argument("--meetings-csv", help="compute the report from this export instead of the rollup table")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="recompute the rollup table from all the meeting instances")
+    parser.add_argument("--by", nargs="+", choices=ROLLUP_KEY_COLUMNS, default=["branch", "week_start"])
+    parser.add_argument("--output", help="write the report to this csv file instead of printing it")
+    args = parser.parse_args()
+    if args.meetings_csv is not None:
+        weekly_rollup = compute_weekly_rollup(prepare_meetings(pd.read_csv(args.meetings_csv, encoding="utf-8-sig")))
+    else:
+        from ETL import DB_Connection as dbc
+        db_connection = dbc.DBconnection()
+        if args.rebuild:
+            rebuild_weekly_rollup(db_connection)
+        weekly_rollup = db_connection.select_into_df("SELECT * FROM %s.%s" % (ROLLUP_SCHEMA, ROLLUP_TABLE))
+    report = summarize_rollup(weekly_rollup, args.by)
+    if args.output is not None:
+        report.to_csv(args.output, index=False)
+    else:
+        print(report.to_string(index=False))
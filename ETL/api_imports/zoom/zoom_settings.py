@@ -0,0 +1,5 @@
+# The Zoom import settings that the DAG files need too, this module must stay free of heavy imports.
+
+BRANCHES = ["10", "20", "30", "40", "50", "60", "70", "80", "90", "100", "200", "300"]
+# The past meetings APIs are in Zoom's "Medium" rate limit group, we keep well below it.
+ZOOM_REQUESTS_PER_SECOND = 10
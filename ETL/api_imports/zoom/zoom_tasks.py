@@ -0,0 +1,36 @@
+"""
+The entry points of the Zoom import for the Airflow tasks.
+The scheduler parses the DAG files over and over, so importing this module must stay cheap: import_zoom (and with it
+pandas, requests and psycopg2) is imported only when a task runs.
+"""
+import shutil
+from ETL.api_imports.zoom.zoom_settings import ZOOM_REQUESTS_PER_SECOND
+
+
+def stage_branch(branch, staging_dir, full_refresh=False, concurrent_branches=1):
+    """
+    Fetches the new meeting instances of the branch into files in the staging directory (see Zoom.stage_branch).
+    :param branch: string represents the branch number.
+    :param staging_dir: string represents the directory the files are written to.
+    :param full_refresh: whether to ignore the import state and fetch the details of all the instances.
+    :param concurrent_branches: int represents the amount of branches staged at the same time, they share the rate
+           limit.
+    :return: list of the written files paths.
+    """
+    from ETL.api_imports.zoom import import_zoom
+    zoom = import_zoom.Zoom(requests_per_second=ZOOM_REQUESTS_PER_SECOND / concurrent_branches)
+    return zoom.stage_branch(branch, staging_dir, full_refresh)
+
+
+def load_staged(branches_staged_files, staging_dir):
+    """
+    Loads the meeting instances staged by all the branches (see Zoom.load_staged) and removes the staging directory.
+    :param branches_staged_files: list of the lists of files paths returned by stage_branch, one per branch.
+    :param staging_dir: string represents the directory the files were written to.
+    :return: [amount of inserted rows, amount of updated rows]
+    """
+    from ETL.api_imports.zoom import import_zoom
+    staged_files = [path for branch_staged_files in branches_staged_files for path in branch_staged_files]
+    inserted, updated = import_zoom.Zoom().load_staged(staged_files)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    return [int(inserted), int(updated)]
@@ -0,0 +1,182 @@
+"""
+The attendee identity index: a small dimension table of the people who signed up to the events, so the distinct
+people and the repeated attendance are read from it instead of self joining all the signups.
+A person is keyed by the hash of the normalized email (the emails themselves are not stored) and gets a stable
+Person_ID derived from the hash, with the first and the last event seen and the amount of events.
+Every load batch of signups updates the index: the batch's events of a person that are outside the events already
+counted for them (before the first or after the last, ordered by date and event id) are added. So loading the same
+batch again, as the sync does for its latest date, counts nothing twice. Events loaded between the first and the last
+event of a person are not counted, so a backfill rebuilds the index from the signups table instead, as does:
+
+    python -m ETL.attendee_identity_index --bigquery-credentials credentials.json
+"""
+from Connectors.BigqueryConnector import BigqueryConnector
+from google.cloud import bigquery
+import pandas as pd
+import argparse
+import hashlib
+import threading
+
+IDENTITY_SCHEMA = "workspace"  # todo: should be the dwh
+IDENTITY_TABLE_NAME = "attendee_identities"
+EMAIL_COLUMN = "Email_address_with_which_you_sign_up_for_shecodes_"
+# the signups columns the index is computed from.
+SIGNUPS_COLUMNS = [EMAIL_COLUMN, "Event_ID", "Date"]
+IDENTITY_KEY_COLUMNS = ["Email_Hash"]
+IDENTITY_TABLE_SCHEMA = [
+    bigquery.SchemaField("Email_Hash", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("Person_ID", "INTEGER"),
+    bigquery.SchemaField("First_Seen", "TIMESTAMP"),
+    bigquery.SchemaField("First_Event_ID", "INTEGER"),
+    bigquery.SchemaField("Last_Seen", "TIMESTAMP"),
+    bigquery.SchemaField("Last_Event_ID", "INTEGER"),
+    bigquery.SchemaField("Event_Count", "INTEGER"),
+    bigquery.SchemaField("Updated_At", "TIMESTAMP"),
+]
+IDENTITY_COLUMNS = [field.name for field in IDENTITY_TABLE_SCHEMA]
+# the amount of hashes looked up by one query, the query parameters are limited in size.
+LOOKUP_CHUNK_SIZE = 10000
+# the index is read, updated and written back, the backfill loads its windows concurrently.
+index_lock = threading.Lock()
+
+
+def normalize_emails(emails):
+    """
+    :return: the emails trimmed and lower cased, missing for the empty ones.
+    """
+    normalized = emails.astype("string").str.strip().str.lower()
+    return normalized.mask(normalized == "")
+
+
+def hash_emails(normalized_emails):
+    """
+    :return: the sha256 hex digests of the normalized emails, every distinct email is hashed once.
+    """
+    hashes = {email: hashlib.sha256(email.encode("utf-8")).hexdigest() for email in normalized_emails.unique()}
+    return normalized_emails.map(hashes).astype(object)
+
+
+def get_person_ids(email_hashes):
+    """
+    :return: the person ids of the hashes: the first 60 bits of the hash, so the id of a person never changes, also
+             when the index is rebuilt.
+    """
+    return email_hashes.map(lambda email_hash: int(email_hash[:15], 16)).astype("int64")
+
+
+def get_signup_events(signups):
+    """
+    :param signups: df of signups rows (the email, Event_ID and Date columns).
+    :return: df of the distinct (Email_Hash, Date, Event_ID) of the signups that have an email, sorted.
+    """
+    emails = normalize_emails(signups[EMAIL_COLUMN])
+    has_email = emails.notna()
+    signup_events = pd.DataFrame({"Email_Hash": hash_emails(emails[has_email]),
+                                  "Date": pd.to_datetime(signups.loc[has_email, "Date"], utc=True),
+                                  "Event_ID": signups.loc[has_email, "Event_ID"].astype("int64")})
+    return signup_events.drop_duplicates().sort_values(["Email_Hash", "Date", "Event_ID"], kind="mergesort",
+                                                       ignore_index=True)
+
+
+def is_before(dates, event_ids, other_dates, other_event_ids):
+    """
+    :return: whether the events (by date, then by event id) are before the other events, elementwise.
+    """
+    return (dates < other_dates) | ((dates == other_dates) & (event_ids < other_event_ids))
+
+
+def compute_identity_updates(signup_events, identities):
+    """
+    :param signup_events: df of the batch's signup events (see get_signup_events).
+    :param identities: df of the index rows of the batch's people (the others may be missing).
+    :return: df of the index rows of the people that have new events, with their updated counters.
+    """
+    email_hashes = pd.Index(signup_events["Email_Hash"].unique())
+    # the people that are not in the index get an empty range of events: the first after the last.
+    current = identities.set_index("Email_Hash").reindex(email_hashes)
+    current_first_dates = pd.to_datetime(current["First_Seen"], utc=True).fillna(pd.Timestamp.max.tz_localize("UTC"))
+    current_last_dates = pd.to_datetime(current["Last_Seen"], utc=True).fillna(pd.Timestamp.min.tz_localize("UTC"))
+    current_first_ids = current["First_Event_ID"].fillna(0).astype("int64")
+    current_last_ids = current["Last_Event_ID"].fillna(0).astype("int64")
+
+    events_first_dates = current_first_dates.reindex(signup_events["Email_Hash"]).to_numpy(dtype="datetime64[ns]")
+    events_last_dates = current_last_dates.reindex(signup_events["Email_Hash"]).to_numpy(dtype="datetime64[ns]")
+    events_first_ids = current_first_ids.reindex(signup_events["Email_Hash"]).to_numpy()
+    events_last_ids = current_last_ids.reindex(signup_events["Email_Hash"]).to_numpy()
+    dates = signup_events["Date"].to_numpy(dtype="datetime64[ns]")
+    event_ids = signup_events["Event_ID"].to_numpy()
+    is_new = (is_before(dates, event_ids, events_first_dates, events_first_ids)
+              | is_before(events_last_dates, events_last_ids, dates, event_ids))
+    new_counts = pd.Series(is_new, index=signup_events.index).groupby(signup_events["Email_Hash"]).sum()
+    new_counts = new_counts.reindex(email_hashes)
+
+    # the events are sorted, so the first and the last rows of a person are the batch's first and last events.
+    batch_events = signup_events.groupby("Email_Hash")[["Date", "Event_ID"]]
+    batch_firsts = batch_events.first().reindex(email_hashes)
+    batch_lasts = batch_events.last().reindex(email_hashes)
+    keeps_first = is_before(current_first_dates, current_first_ids, batch_firsts["Date"], batch_firsts["Event_ID"])
+    keeps_last = is_before(batch_lasts["Date"], batch_lasts["Event_ID"], current_last_dates, current_last_ids)
+    updates = pd.DataFrame({
+        "Email_Hash": email_hashes.to_series(),
+        "Person_ID": get_person_ids(email_hashes.to_series()),
+        "First_Seen": current_first_dates.where(keeps_first, batch_firsts["Date"]),
+        "First_Event_ID": current_first_ids.where(keeps_first, batch_firsts["Event_ID"]),
+        "Last_Seen": current_last_dates.where(keeps_last, batch_lasts["Date"]),
+        "Last_Event_ID": current_last_ids.where(keeps_last, batch_lasts["Event_ID"]),
+        "Event_Count": current["Event_Count"].fillna(0).astype("int64") + new_counts,
+        "Updated_At": pd.Timestamp.now(tz="UTC"),
+    }, index=email_hashes, columns=IDENTITY_COLUMNS)
+    return updates[new_counts > 0].reset_index(drop=True)
+
+
+def update_identity_index(b, signups):
+    """
+    Adds the batch's signups to the identity index (see the module's doc).
+    :param b: BigquaryConnector
+    :param signups: df of the batch's signups rows.
+    :return: the amount of people whose index row was inserted or updated.
+    """
+    signup_events = get_signup_events(signups)
+    if signup_events.empty:
+        return 0
+    email_hashes = list(signup_events["Email_Hash"].unique())
+    with index_lock:
+        b.create_table_if_not_exists(IDENTITY_SCHEMA, IDENTITY_TABLE_NAME, IDENTITY_TABLE_SCHEMA, IDENTITY_KEY_COLUMNS)
+        identities = pd.concat([b.get_dim_full_table(IDENTITY_SCHEMA, IDENTITY_TABLE_NAME, IDENTITY_COLUMNS,
+                                                     where={"Email_Hash": email_hashes[i:i + LOOKUP_CHUNK_SIZE]})
+                                for i in range(0, len(email_hashes), LOOKUP_CHUNK_SIZE)], ignore_index=True)
+        updates = compute_identity_updates(signup_events, identities)
+        b.merge_rows(IDENTITY_SCHEMA, IDENTITY_TABLE_NAME, updates, IDENTITY_KEY_COLUMNS)
+    print("The identity index was updated for %d people" % len(updates))
+    return len(updates)
+
+
+def rebuild_identity_index(b, signups_schema, signups_table_name):
+    """
+    Recomputes the index rows of all the people from the signups table and replaces the index by them, so the people
+    that have no signups left are removed.
+    :param b: BigquaryConnector
+    :param signups_schema: string represents the signups table's scheme name.
+    :param signups_table_name: string represents the signups table name.
+    :return: the amount of people in the index.
+    """
+    if b.bqstorage_client is not None:
+        signups = b.read_table(signups_schema, signups_table_name, SIGNUPS_COLUMNS)
+    else:
+        # google-cloud-bigquery-storage is optional, without it the signups are read by a query.
+        signups = b.get_dim_full_table(signups_schema, signups_table_name, columns=SIGNUPS_COLUMNS)
+    identities = compute_identity_updates(get_signup_events(signups), pd.DataFrame(columns=IDENTITY_COLUMNS))
+    with index_lock:
+        b.create_table_if_not_exists(IDENTITY_SCHEMA, IDENTITY_TABLE_NAME, IDENTITY_TABLE_SCHEMA, IDENTITY_KEY_COLUMNS)
+        b.replace_table_rows(IDENTITY_SCHEMA, IDENTITY_TABLE_NAME, identities)
+    return len(identities)
+
+
+if __name__ == '__main__':
+    from ETL.etl_eventbrite_signups_to_bigquery import SIGNUPS_SCHEMA, SIGNUPS_TABLE_NAME
+    parser = argparse.ArgumentParser(description="Rebuilds the attendee identity index from the signups table")
+    parser.add_argument("--bigquery-credentials", required=True, help="the service account json file")
+    args = parser.parse_args()
+    people_count = rebuild_identity_index(BigqueryConnector(args.bigquery_credentials), SIGNUPS_SCHEMA,
+                                          SIGNUPS_TABLE_NAME)
+    print("The identity index holds %d people" % people_count)
@@ -0,0 +1,236 @@
+"""
+Backfills the eventbrite tables in BigQuery for a range of dates, window by window.
+The range is split into day or week windows that are processed in parallel. Every window replaces its rows in the
+tables atomically (see BigqueryConnector.replace_rows_in_window), so a window can be loaded again safely, and is
+recorded in the checkpoint file once it is committed. Running the same command again resumes from the checkpoint,
+skipping the committed windows:
+
+    python -m ETL.backfill_eventbrite_to_bigquery --from-date 2019-01-01 --to-date 2021-12-31 --window week --workers 8
+
+Once windows were loaded, the attendee identity index is rebuilt from the signups table (it can not count events
+loaded out of order, see attendee_identity_index).
+
+With --staging-dir the extracted rows of every window are staged as parquet files and loaded from them, and with
+--from-staging too the windows are loaded from the staged files, without extracting from eventbrite again.
+"""
+from Connectors.BigqueryConnector import BigqueryConnector
+from Connectors.EventbriteConnector import EventbriteConnector
+from Connectors.StagingStore import StagingStore, count_parquet_rows
+from ETL.attendee_identity_index import rebuild_identity_index
+from ETL.etl_eventbrite_signups_to_bigquery import EVENTS_SCHEMA, EVENTS_TABLE_NAME, SIGNUPS_SCHEMA, \
+    SIGNUPS_TABLE_NAME, EVENTS_DATASET, SIGNUPS_DATASET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+import os
+import sys
+import json
+import argparse
+import threading
+import pandas as pd
+
+WINDOW_DAYS = {"day": 1, "week": 7}
+DEFAULT_CHECKPOINT_FILE = "eventbrite_backfill_checkpoint.json"
+DEFAULT_MAX_WORKERS = 4
+
+
+def split_into_windows(from_date, to_date, window="day"):
+    """
+    :param from_date: datetime.date represents the range's start date.
+    :param to_date: datetime.date represents the range's end date (including).
+    :param window: "day" or "week".
+    :return: list of (window start date, window end date) that cover the range, the last window may be shorter.
+    """
+    if window not in WINDOW_DAYS:
+        raise ValueError("Illegal window " + str(window) + ", expected one of " + str(list(WINDOW_DAYS)))
+    windows = []
+    window_start = from_date
+    while window_start <= to_date:
+        window_end = min(to_date, window_start + timedelta(days=WINDOW_DAYS[window] - 1))
+        windows.append((window_start, window_end))
+        window_start = window_end + timedelta(days=1)
+    return windows
+
+
+def filter_events_in_range(events, date_column, from_date, to_date):
+    """
+    :param events: df of the raw events.
+    :param date_column: string represents the column of the events' date ("start.local" or "start.utc").
+    :return: the events that their date is in the interval [from_date, to_date].
+    """
+    if events.empty:
+        return events
+    event_dates = events[date_column].str[:10]
+    return events[(event_dates >= str(from_date)) & (event_dates <= str(to_date))]
+
+
+class Checkpoint:
+    """
+    The committed windows of a backfill, saved to a json file after every window, so a stopped backfill resumes
+    from where it stopped.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: string represents the checkpoint file path, loaded when it exists.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.completed_windows = set()
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.completed_windows = set(json.load(checkpoint_file)["completed_windows"])
+
+    def is_completed(self, window):
+        return self.get_key(window) in self.completed_windows
+
+    def mark_completed(self, window):
+        with self.lock:
+            self.completed_windows.add(self.get_key(window))
+            # written aside and renamed, so a crash while writing never leaves a broken checkpoint.
+            with open(self.path + ".tmp", "w") as checkpoint_file:
+                json.dump({"completed_windows": sorted(self.completed_windows)}, checkpoint_file, indent=2)
+            os.replace(self.path + ".tmp", self.path)
+
+    # ------------------------------- inner methods (not as part of the API) ------------------------------------
+
+    def get_key(self, window):
+        return "%s/%s" % window
+
+
+def extract_window(e, window):
+    """
+    Extracts the events and the signups of the events that occurred in the window.
+    The events table is dated by the events' local start time and the signups table by their UTC start time, so the
+    events are fetched with a day of margin and every table takes the events of the window by its own date.
+    :param e: EventbriteConnector
+    :param window: (window start date, window end date)
+    :return: (df of the events, df of the signups)
+    """
+    from_date, to_date = window
+    events = e.get_events_in_time_range(str(from_date - timedelta(days=1)), str(to_date + timedelta(days=1)))
+    window_events = e.project_into_events_table_schema(
+        filter_events_in_range(events, "start.local", from_date, to_date))
+    # the windows are already processed in parallel, so the events of a window are fetched one by one.
+    window_signups = e.get_arranged_signups_of_events(filter_events_in_range(events, "start.utc", from_date, to_date),
+                                                      max_workers=1)
+    return window_events, window_signups
+
+
+def backfill_window(b, e, window, staging_store=None, from_staging=False):
+    """
+    Replaces the events and the signups of the events that occurred in the window.
+    :param b: BigquaryConnector
+    :param e: EventbriteConnector
+    :param window: (window start date, window end date)
+    :param staging_store: StagingStore the window's rows are staged in and loaded from, None for no staging.
+    :param from_staging: whether to load the rows staged before instead of extracting them.
+    :return: (amount of events, amount of signups)
+    """
+    from_date, to_date = window
+    if from_staging:
+        # a window that was never staged (e.g. a wrong staging dir) fails, as loading it would delete the window's
+        # rows. A window that was staged without rows has no files, it is loaded as empty.
+        for dataset in [EVENTS_DATASET, SIGNUPS_DATASET]:
+            if not staging_store.is_staged(dataset, from_date, to_date) and \
+                    not staging_store.get_paths(dataset, from_date, to_date):
+                raise ValueError("The window is not staged in " + staging_store.root_dir)
+        window_events = staging_store.get_paths(EVENTS_DATASET, from_date, to_date) or pd.DataFrame()
+        window_signups = staging_store.get_paths(SIGNUPS_DATASET, from_date, to_date) or pd.DataFrame()
+    else:
+        window_events, window_signups = extract_window(e, window)
+    if staging_store is not None and not from_staging:
+        # the window's staged dates are replaced as a whole, so the dates that have no rows anymore are removed too.
+        for dataset, rows in [(EVENTS_DATASET, window_events), (SIGNUPS_DATASET, window_signups)]:
+            staging_store.remove(dataset, from_date, to_date)
+            staging_store.write(dataset, rows, "Date")
+            staging_store.mark_staged(dataset, from_date, to_date)
+        # a window without rows has no staged files, its (empty) df is loaded instead.
+        window_events = staging_store.get_paths(EVENTS_DATASET, from_date, to_date) or window_events
+        window_signups = staging_store.get_paths(SIGNUPS_DATASET, from_date, to_date) or window_signups
+    b.replace_rows_in_window(EVENTS_SCHEMA, EVENTS_TABLE_NAME, window_events, str(from_date), str(to_date))
+    b.replace_rows_in_window(SIGNUPS_SCHEMA, SIGNUPS_TABLE_NAME, window_signups, str(from_date), str(to_date))
+    return count_rows(window_events), count_rows(window_signups)
+
+
+def count_rows(rows):
+    """
+    :param rows: df, or list of parquet files paths.
+    :return: the amount of rows.
+    """
+    if isinstance(rows, list):
+        return count_parquet_rows(rows)
+    return len(rows)
+
+
+def run_backfill(b, e, from_date, to_date, window="day", max_workers=DEFAULT_MAX_WORKERS,
+                 checkpoint_path=DEFAULT_CHECKPOINT_FILE, staging_store=None, from_staging=False):
+    """
+    Backfills the range window by window, in parallel, skipping the windows that are already in the checkpoint, and
+    then rebuilds the attendee identity index.
+    A failed window does not stop the others, it is left out of the checkpoint to be retried by the next run.
+    :param b: BigquaryConnector
+    :param e: EventbriteConnector
+    :param from_date: datetime.date represents the range's start date.
+    :param to_date: datetime.date represents the range's end date (including).
+    :param window: "day" or "week".
+    :param max_workers: int represents the maximal amount of windows processed at the same time.
+    :param checkpoint_path: string represents the checkpoint file path.
+    :param staging_store: StagingStore the windows' rows are staged in and loaded from, None for no staging.
+    :param from_staging: whether to load the rows staged before instead of extracting them.
+    :return: list of the windows that failed.
+    """
+    if from_staging and staging_store is None:
+        raise ValueError("Loading from the staging requires a staging store")
+    checkpoint = Checkpoint(checkpoint_path)
+    windows = [window_range for window_range in split_into_windows(from_date, to_date, window)
+               if not checkpoint.is_completed(window_range)]
+    print("Backfilling %d windows from %s to %s" % (len(windows), from_date, to_date))
+    failed_windows = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(backfill_window, b, e, window_range, staging_store, from_staging): window_range
+                   for window_range in windows}
+        for future in as_completed(futures):
+            window_range = futures[future]
+            try:
+                events_count, signups_count = future.result()
+            except Exception as error:
+                print("Window %s - %s failed: %s" % (window_range[0], window_range[1], error))
+                failed_windows.append(window_range)
+                continue
+            checkpoint.mark_completed(window_range)
+            print("Window %s - %s done: %d events, %d signups" % (window_range[0], window_range[1], events_count,
+                                                                   signups_count))
+    if len(failed_windows) < len(windows):
+        print("Rebuilding the identity index of %d people" % rebuild_identity_index(b, SIGNUPS_SCHEMA,
+                                                                                    SIGNUPS_TABLE_NAME))
+    return sorted(failed_windows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backfills the eventbrite tables in BigQuery")
+    parser.add_argument("--from-date", type=date.fromisoformat, required=True, help="format YYYY-MM-DD")
+    parser.add_argument("--to-date", type=date.fromisoformat, default=date.today(), help="format YYYY-MM-DD, "
+                                                                                          "including")
+    parser.add_argument("--window", choices=list(WINDOW_DAYS), default="day")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_FILE, help="the file the progress is kept in")
+    parser.add_argument("--bigquery-credentials", required=True, help="the service account json file")
+    parser.add_argument("--eventbrite-config", help="the json file of the token and organization id, not needed "
+                                                    "with --from-staging")
+    parser.add_argument("--staging-dir", help="stage the extracted rows as parquet files in this directory")
+    parser.add_argument("--from-staging", action="store_true",
+                        help="load the rows staged in --staging-dir instead of extracting them")
+    args = parser.parse_args()
+    if args.from_staging and args.staging_dir is None:
+        parser.error("--from-staging requires --staging-dir")
+    if not args.from_staging and args.eventbrite_config is None:
+        parser.error("--eventbrite-config is required unless loading --from-staging")
+    failed = run_backfill(BigqueryConnector(args.bigquery_credentials),
+                          None if args.from_staging else EventbriteConnector(args.eventbrite_config,
+                                                                             max_workers=args.workers),
+                          args.from_date, args.to_date, args.window, args.workers, args.checkpoint,
+                          None if args.staging_dir is None else StagingStore(args.staging_dir), args.from_staging)
+    if failed:
+        print("%d windows failed, run the same command again to retry them" % len(failed))
+        sys.exit(1)
+    print("end")
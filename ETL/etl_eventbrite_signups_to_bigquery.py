@@ -1,47 +1,152 @@
-from etl_directory.BigqueryConnector import BigqueryConnector
-from etl_directory.EventbriteConnector import EventbriteConnector
+from Connectors.BigqueryConnector import BigqueryConnector
+from Connectors.EventbriteConnector import EventbriteConnector, SIGNUPS_TABLE_COLUMNS, \
+    SIGNUPS_BOOLEAN_ANSWER_COLUMNS
+from ETL.etl_runner import EtlRunner
+from ETL.attendee_identity_index import update_identity_index
+from google.cloud import bigquery
+from datetime import date
 import pandas as pd
 
+EVENTS_SCHEMA = "workspace"  # todo: should be the mrr
+EVENTS_TABLE_NAME = "eventsbrite_events_copy"  # todo: not copy
+SIGNUPS_SCHEMA = "workspace"  # todo: should be the dwh
+SIGNUPS_TABLE_NAME = "dec_signups"  # todo: eventbrite_signups
+STATE_SCHEMA = "workspace"  # todo: should be the mrr
+EVENTS_KEY_COLUMNS = ["Event", "Date"]  # todo: Event_ID, after the events table schema get changed
+SIGNUPS_KEY_COLUMNS = ["Event_ID", "Email_address_with_which_you_sign_up_for_shecodes_", "Order_Date"]
+# the datasets of the extracted rows in the staging store, partitioned by the "Date" column.
+EVENTS_DATASET = "eventbrite_events"
+SIGNUPS_DATASET = "eventbrite_signups"
 
-def etl_events_table(b, e):
+# columns that are not free text answers, all the others are strings.
+SIGNUPS_TYPED_COLUMNS = dict({column: "BOOLEAN" for column in SIGNUPS_BOOLEAN_ANSWER_COLUMNS},
+                             Corona_="BOOLEAN", Date="TIMESTAMP", Order_Date="TIMESTAMP", Event_ID="INTEGER")
+SIGNUPS_TABLE_SCHEMA = [bigquery.SchemaField(column, SIGNUPS_TYPED_COLUMNS.get(column, "STRING"))
+                        for column in SIGNUPS_TABLE_COLUMNS]
+
+
+def etl_events_table(b, e, latest_date=None, events=None, staging_store=None):
     """
     Updates the "eventbrite_events" table to contain also newer events-
     events that occurred between the newest event in the table and today.
     :param b: BigquaryConnector
     :param e: EventbriteConnector
+    :param latest_date: datetime.date the sync starts from, None to get it by get_sync_start_date.
+    :param events: df of the raw events from latest_date (or earlier) until today, None to fetch them.
+    :param staging_store: StagingStore the new rows are staged in (EVENTS_DATASET), None for no staging.
     :return:
     """
-    schema = "workspace" # todo: should be the mrr
-    table_name = "eventsbrite_events_copy" # todo: not copy
-    latest_date = b.get_newest_event_date(schema, table_name)
-    new_events = e.get_arranged_events_in_time_range(str(latest_date))
-    # replace the rows in order to hold all the events that occurred on the latest date, and only once.
-    b.replace_rows_in_time_range(schema, table_name, new_events, str(latest_date), str(latest_date), "Date")
+    if latest_date is None:
+        latest_date = get_sync_start_date(b, EVENTS_SCHEMA, EVENTS_TABLE_NAME)
+    if events is None:
+        events = e.get_events_in_time_range(str(latest_date), str(date.today()))
+    new_events = e.project_into_events_table_schema(filter_events_from_date(events, latest_date))
+    if staging_store is not None:
+        staging_store.write(EVENTS_DATASET, new_events, "Date")
+    # merge the rows in order to hold all the events that occurred on the latest date, and only once.
+    b.merge_rows(EVENTS_SCHEMA, EVENTS_TABLE_NAME, new_events, EVENTS_KEY_COLUMNS)
+    update_sync_watermark(b, EVENTS_TABLE_NAME, new_events)
 
 
-def etl_signups_table(b, e):
+def etl_signups_table(b, e, latest_date=None, events=None, staging_store=None):
     """
     Updates the "eventbrite_signups" table to contain also newer signups-
-    signups of events that occurred between the newest signup record in the table and today.
+    signups of events that occurred between the newest signup record in the table and today, and adds them to the
+    attendee identity index.
     :param b: BigquaryConnector
     :param e: EventbriteConnector
+    :param latest_date: datetime.date the sync starts from, None to get it by get_sync_start_date.
+    :param events: df of the raw events from latest_date (or earlier) until today, None to fetch them.
+    :param staging_store: StagingStore the new rows are staged in (SIGNUPS_DATASET), None for no staging.
     :return:
     """
     # Right now the date col in the signups table is in inappropriate format, should be changes.
     # For now, you can create "dec_signups" by the func "db_create_formatted_signups_table" and check
     # your work on it.
-    schema = "workspace" # todo: should be the dwh
-    table_name = "dec_signups" # todo: eventbrite_signups
-    latest_date = b.get_newest_event_date(schema, table_name)
-    new_events = e.get_arranged_signups_in_time_range(str(latest_date))
-    b.replace_rows_in_time_range(schema, table_name, new_events, str(latest_date), str(latest_date), "Date")
+    if latest_date is None:
+        latest_date = get_sync_start_date(b, SIGNUPS_SCHEMA, SIGNUPS_TABLE_NAME)
+    if events is None:
+        events = e.get_events_in_time_range(str(latest_date), str(date.today()))
+    new_signups = e.get_arranged_signups_of_events(filter_events_from_date(events, latest_date))
+    if staging_store is not None:
+        staging_store.write(SIGNUPS_DATASET, new_signups, "Date")
+    b.merge_rows(SIGNUPS_SCHEMA, SIGNUPS_TABLE_NAME, new_signups, SIGNUPS_KEY_COLUMNS)
+    # the index is updated before the watermark, so a failure loads the batch again and it is counted once.
+    update_identity_index(b, new_signups)
+    update_sync_watermark(b, SIGNUPS_TABLE_NAME, new_signups)
+
+
+def run_eventbrite_etl(b, e, max_workers=4, staging_store=None):
+    """
+    Updates all the eventbrite tables. The events are fetched from eventbrite once, from the earliest start date of
+    the tables, and shared by the tables, which are updated concurrently.
+    :param b: BigquaryConnector
+    :param e: EventbriteConnector
+    :param max_workers: int represents the maximal amount of stages that run at the same time.
+    :param staging_store: StagingStore the new rows are staged in, None for no staging.
+    :return: dict of stage name -> the time it took in seconds.
+    """
+    runner = EtlRunner(max_workers)
+    runner.add_stage("events_start_date", lambda: get_sync_start_date(b, EVENTS_SCHEMA, EVENTS_TABLE_NAME))
+    runner.add_stage("signups_start_date", lambda: get_sync_start_date(b, SIGNUPS_SCHEMA, SIGNUPS_TABLE_NAME))
+    runner.add_stage("eventbrite_events",
+                     lambda *start_dates: e.get_events_in_time_range(str(min(start_dates)), str(date.today())),
+                     ["events_start_date", "signups_start_date"])
+    runner.add_stage("events_table",
+                     lambda latest_date, events: etl_events_table(b, e, latest_date, events, staging_store),
+                     ["events_start_date", "eventbrite_events"])
+    runner.add_stage("signups_table",
+                     lambda latest_date, events: etl_signups_table(b, e, latest_date, events, staging_store),
+                     ["signups_start_date", "eventbrite_events"])
+    runner.run()
+    return runner.timings
+
+
+def filter_events_from_date(events, from_date):
+    """
+    :param events: df of the raw events.
+    :param from_date: datetime.date
+    :return: the events that start on from_date or later.
+    """
+    if events.empty:
+        return events
+    return events[events['start.local'].str[:10] >= str(from_date)]
+
+
+def get_sync_start_date(b, schema, table_name):
+    """
+    Returns the date the sync of the table should start from: the saved watermark, or for a table that was never
+    synced before, the newest date in the table.
+    :param b: BigquaryConnector
+    :param schema: string represents the table's scheme name.
+    :param table_name: string represents the table name, used also as the sync name.
+    :return: Type datetime.date
+    """
+    watermark = b.get_watermark(STATE_SCHEMA, table_name)
+    if watermark is None:
+        watermark = b.get_newest_event_date(schema, table_name)
+    return watermark
+
+
+def update_sync_watermark(b, table_name, new_rows):
+    """
+    Saves the newest date of the synced rows as the watermark, the next sync starts from it (including).
+    :param b: BigquaryConnector
+    :param table_name: string represents the table name, used also as the sync name.
+    :param new_rows: df of the synced rows.
+    :return:
+    """
+    if new_rows.empty:
+        return
+    b.set_watermark(STATE_SCHEMA, table_name, str(pd.to_datetime(new_rows["Date"]).max().date()))
 
 # ------------------------------------------- db only ---------------------------------------------------
 
 
 def db_create_formatted_signups_table():
     dec_signups = e.get_arranged_signups_in_time_range("2021-12-01", "2021-12-31")
-    b.load_new_table("workspace", "dec_signups", dec_signups)
+    b.load_new_table("workspace", "dec_signups", dec_signups, partition_column="Date", clustering_columns=["Event_ID"],
+                     schema=SIGNUPS_TABLE_SCHEMA)
 
 
 def db_copy_events_table_to_workspace(b):
@@ -52,12 +157,19 @@ def db_copy_signups_table_to_workspace(b):
     b.load_new_table("workspace", "eventbrite_signups_copy", b.get_dim_full_table("dwh", "eventbrite_signups"))
 
 
+def db_migrate_signups_table_to_partitioned(b):
+    b.migrate_to_partitioned_table("dwh", "eventbrite_signups", "eventbrite_signups_partitioned", "Date", ["Event_ID"])
+
+
+def db_migrate_events_table_to_partitioned(b):
+    b.migrate_to_partitioned_table("mrr", "eventbrite_events", "eventbrite_events_partitioned", "Date")
+
+
 if __name__ == '__main__':
     b = BigqueryConnector(
         "C:\\Users\\naama\\Documents\\sheCodes\\firstTask\\etl_directory\\concrete-bloom-330808-fe99bbc7ff24.json")
     e = EventbriteConnector("C:\\Users\\naama\\Documents\\sheCodes\\firstTask\\etl_directory\\eventbrite-info.json")
     pd.set_option('display.max_columns', None, 'display.max_rows', None, 'expand_frame_repr', False,'display.max_colwidth', None)
-    etl_events_table(b, e)
-    etl_signups_table(b, e)
+    run_eventbrite_etl(b, e)
     print("end")
 
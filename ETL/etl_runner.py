@@ -0,0 +1,71 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class EtlRunner:
+    """
+    Runs ETL stages according to their dependencies.
+    Every stage runs once, as soon as all the stages it depends on are done, and gets their results as arguments, so
+    a shared upstream fetch is done once and independent stages run concurrently.
+    """
+
+    def __init__(self, max_workers=4):
+        """
+        :param max_workers: int represents the maximal amount of stages that run at the same time.
+        """
+        self.max_workers = max_workers
+        self.stages = {}
+        self.timings = {}
+
+    def add_stage(self, name, func, dependencies=()):
+        """
+        :param name: string represents the stage name.
+        :param func: callable that performs the stage, called with the results of the dependencies (in their order).
+        :param dependencies: list of the names of the stages this stage depends on, they must be added before it.
+        :return:
+
+        :raise ValueError when the name is already used or a dependency was not added.
+        """
+        if name in self.stages:
+            raise ValueError("Stage " + name + " already exists")
+        for dependency in dependencies:
+            if dependency not in self.stages:
+                raise ValueError("Stage " + name + " depends on unknown stage " + dependency)
+        self.stages[name] = (func, list(dependencies))
+
+    def run(self):
+        """
+        Runs all the stages and prints the time each of them took.
+        :return: dict of stage name -> the stage's result.
+
+        :raise the exception of the first stage that failed, the stages that depend on it don't run.
+        """
+        results = {}
+        self.timings = {}
+        pending_stages = dict(self.stages)
+        running_stages = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending_stages or running_stages:
+                for name, (func, dependencies) in list(pending_stages.items()):
+                    if all(dependency in results for dependency in dependencies):
+                        arguments = [results[dependency] for dependency in dependencies]
+                        running_stages[executor.submit(self.run_stage, name, func, arguments)] = name
+                        del pending_stages[name]
+                done_stages, _ = wait(running_stages, return_when=FIRST_COMPLETED)
+                for future in done_stages:
+                    results[running_stages.pop(future)] = future.result()
+        self.print_timings()
+        return results
+
+    def print_timings(self):
+        for name, seconds in self.timings.items():
+            print("%s: %.2f seconds" % (name, seconds))
+
+    # ------------------------------- inner methods (not as part of the API) ------------------------------------
+
+    def run_stage(self, name, func, arguments):
+        start_time = time.perf_counter()
+        try:
+            return func(*arguments)
+        finally:
+            self.timings[name] = time.perf_counter() - start_time
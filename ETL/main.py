@@ -1,25 +1,21 @@
-import requests
-import pandas as pd
-import json
-from datetime import datetime
-import DB_Connection as dbc
-from configparser import ConfigParser
+import os
+import sys
+from ETL import DB_Connection as dbc
 
 
-# Press the green button in the gutter to run the script.
+# Run from the repository root (the import root of the ETL and the Connectors packages):
+#     python -m ETL.main
 if __name__ == '__main__':
     print('PyCharm')
     con = dbc.DBconnection()
 
-    csv_file = "./global-temp-monthly.csv"
-    df = pd.read_csv(csv_file)
-    df = df.rename(columns={
-        "Source": "Source",
-        "Date": "Date",
-        "Mean": "Mean"
-    })
-
-    con.insert_into_db(df, "data_load","test")
+    csv_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "global-temp-monthly.csv")
+    # the file columns (Source, Date, Mean) are in the table's order, so it is streamed as is.
+    # merging (on the unique key of the table) keeps re-runs from duplicating the rows.
+    if con.create_unique_key("data_load", "test", ["Source", "Date"]) != 0 or \
+            con.merge_into_db(csv_file, "data_load", "test", ["Source", "Date"]) is None:
+        con.disconnect()
+        sys.exit("Loading %s into data_load.test failed" % csv_file)
 
     con.disconnect()
 
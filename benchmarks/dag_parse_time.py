@@ -0,0 +1,72 @@
+"""
+Checks the parse time of the DAG files against a budget, the way the scheduler parses them: in a process that already
+imported airflow. Every DAG file is parsed in fresh processes and the median time is compared to the budget; the heavy
+modules the parse imported are reported too. Exits with status 1 when a DAG is over the budget:
+
+    python -m benchmarks.dag_parse_time --budget-ms 200
+"""
+import os
+import sys
+import glob
+import json
+import argparse
+import statistics
+import subprocess
+
+DEFAULT_BUDGET_MS = 200
+DEFAULT_RUNS = 5
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DAGS_DIR = os.path.join(REPO_DIR, "dags")
+# modules that should be imported only when the tasks run.
+HEAVY_MODULES = ["pandas", "numpy", "requests", "psycopg2", "google.cloud.bigquery"]
+
+PARSE_SCRIPT = """
+import sys, time, json, importlib.util
+import airflow
+import airflow.decorators
+modules_before = set(sys.modules)
+start_time = time.perf_counter()
+spec = importlib.util.spec_from_file_location("parsed_dag", sys.argv[1])
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+seconds = time.perf_counter() - start_time
+print(json.dumps({"seconds": seconds, "modules": sorted(set(sys.modules) - modules_before)}))
+"""
+
+
+def parse_dag(dag_path):
+    """
+    Parses the DAG file in a fresh process (with the repository in the path, as in the deployment).
+    :return: dict with the parse "seconds" and the "modules" the parse imported.
+    """
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_DIR, os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run([sys.executable, "-c", PARSE_SCRIPT, dag_path], capture_output=True, text=True,
+                            cwd=REPO_DIR, env=environment)
+    if result.returncode != 0:
+        raise Exception("Parsing " + dag_path + " failed:\n" + result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def check_dag(dag_path, budget_ms=DEFAULT_BUDGET_MS, runs=DEFAULT_RUNS):
+    """
+    :return: dict of the DAG's median parse time, whether it is in the budget and the heavy modules it imported.
+    """
+    parses = [parse_dag(dag_path) for _ in range(runs)]
+    median_ms = statistics.median(parse["seconds"] for parse in parses) * 1000
+    heavy_modules = [module for module in HEAVY_MODULES if module in parses[0]["modules"]]
+    return {"dag": os.path.relpath(dag_path, REPO_DIR), "median_ms": round(median_ms, 1), "budget_ms": budget_ms,
+            "in_budget": median_ms <= budget_ms, "heavy_modules": heavy_modules}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Checks the parse time of the DAG files against a budget")
+    parser.add_argument("dags", nargs="*", help="the DAG files to check, all the files in dags/ by default")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="the amount of parses per DAG")
+    args = parser.parse_args()
+    dag_paths = args.dags or sorted(glob.glob(os.path.join(DAGS_DIR, "*.py")))
+    results = [check_dag(os.path.abspath(dag_path), args.budget_ms, args.runs) for dag_path in dag_paths]
+    for dag_result in results:
+        print("%s: %.1f ms (budget %.0f ms)%s" % (dag_result["dag"], dag_result["median_ms"], dag_result["budget_ms"],
+                                                  ", imports " + ", ".join(dag_result["heavy_modules"])
+                                                  if dag_result["heavy_modules"] else ""))
+    sys.exit(0 if all(dag_result["in_budget"] for dag_result in results) else 1)
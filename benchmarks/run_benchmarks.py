@@ -0,0 +1,233 @@
+"""
+Offline benchmarks of the ETL hot paths, against synthetic Eventbrite and Zoom payloads served by a local stub server.
+Every stage is run at every scale (the amount of attendees), its throughput and peak memory are reported and all the
+results are written to a json file, to compare between commits:
+
+    python -m benchmarks.run_benchmarks --scales 1000 100000 --output after.json --compare before.json
+
+The rows are streamed by the COPY code path of DBconnection.insert_into_db into a stand-in connection that reads and
+discards the streamed data (so the stage measures our serialization and streaming, without a server), unless a
+Postgres config is given (--db-config), then they are loaded by insert_into_db into a scratch table that is dropped
+afterwards.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import pandas as pd
+from datetime import datetime
+from Connectors.EventbriteConnector import EventbriteConnector, get_request
+from ETL import DB_Connection as dbc
+from ETL.api_imports.zoom import import_zoom
+from benchmarks import synthetic_payloads
+from benchmarks.stub_api_server import StubApiServer
+
+DEFAULT_SCALES = [1000, 100000, 1000000]
+DEFAULT_OUTPUT_FILE = "benchmark_results.json"
+# the details of every Zoom instance are fetched by their own request, so the fetch stage is capped.
+MAX_ZOOM_FETCHED_INSTANCES = 10000
+# high enough for the rate limiters to never wait.
+UNLIMITED_RATE = 10 ** 9
+BENCHMARK_TABLE = "benchmark_signups"
+
+
+def measure(func, rows, measure_memory=True):
+    """
+    Runs the stage once for the timing and, when measure_memory, once more under tracemalloc for the peak memory
+    (tracing slows the allocations down, so the timed run is not traced).
+    :param func: callable that performs the stage.
+    :param rows: int represents the amount of rows the stage processes.
+    :return: (the stage's result, dict of the stage's measurements)
+    """
+    gc.collect()
+    start_time = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start_time
+    stats = {"rows": rows, "seconds": round(seconds, 4), "rows_per_second": round(rows / seconds, 1) if seconds else None}
+    if measure_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            stats["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, stats
+
+
+def write_eventbrite_config(directory):
+    path = os.path.join(directory, "eventbrite.json")
+    with open(path, "w") as json_file:
+        json.dump({"token": "benchmark", "organization_id": "1"}, json_file)
+    return path
+
+
+def write_zoom_config(directory):
+    # Zoom reads its config relative to the working directory.
+    os.makedirs(os.path.join(directory, "configs"), exist_ok=True)
+    with open(os.path.join(directory, "configs", "zoom.ini"), "w") as config_file:
+        config_file.write("[Auth]\nauthorization = Bearer benchmark\n")
+
+
+class CopySinkCursor:
+    """
+    Stand-in of a psycopg2 cursor that consumes the COPY data as the server does, read by read, and counts its bytes.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def copy_expert(self, sql, file, size=8192):
+        while True:
+            data = file.read(size)
+            if not data:
+                return
+            self.connection.copied_bytes += len(data)
+
+    def close(self):
+        pass
+
+
+class CopySinkConnection:
+    def __init__(self):
+        self.copied_bytes = 0
+
+    def cursor(self):
+        return CopySinkCursor(self)
+
+
+def load_into_copy_sink(df):
+    sink_connection = CopySinkConnection()
+    dbc.DBconnection().copy_into_table(sink_connection, df, "public", BENCHMARK_TABLE, BENCHMARK_TABLE,
+                                       dbc.DEFAULT_CHUNK_SIZE, False)
+    return sink_connection.copied_bytes
+
+
+def load_into_postgres(con, df):
+    columns = ", ".join('"%s" text' % column for column in df.columns)
+    con.execute("DROP TABLE IF EXISTS public.%s; CREATE TABLE public.%s (%s)" % (BENCHMARK_TABLE, BENCHMARK_TABLE,
+                                                                                  columns))
+    try:
+        if con.insert_into_db(df, "public", BENCHMARK_TABLE) != 0:
+            raise Exception("Loading the benchmark rows failed")
+    finally:
+        con.execute("DROP TABLE IF EXISTS public.%s" % BENCHMARK_TABLE)
+
+
+def run_eventbrite_stages(server, connector, scale, db_connection, measure_memory):
+    server.attendees_count = scale
+    url = server.url + "/v3/events/" + synthetic_payloads.BENCHMARK_EVENT_ID + "/attendees/?&token=benchmark"
+    results = {}
+    raw_signups, results["eventbrite_pagination"] = measure(
+        lambda: connector.get_all_rows(url, get_request(url, connector.http_client), "attendees"), scale,
+        measure_memory)
+    signups, results["signups_projection"] = measure(
+        lambda: connector.project_into_signups_table_schema(raw_signups, synthetic_payloads.BENCHMARK_EVENT_ID,
+                                                            "Benchmark event", "2021-06-01"), scale, measure_memory)
+    del raw_signups
+    csv_bytes, results["db_serialize_csv"] = measure(
+        lambda: sum(len(chunk) for chunk in dbc.iter_csv_chunks(signups, dbc.DEFAULT_CHUNK_SIZE)), scale,
+        measure_memory)
+    results["db_serialize_csv"]["bytes"] = csv_bytes
+    if db_connection is None:
+        copied_bytes, results["db_insert_copy_stream"] = measure(lambda: load_into_copy_sink(signups), scale,
+                                                                 measure_memory)
+        results["db_insert_copy_stream"]["bytes"] = copied_bytes
+    else:
+        _, results["db_insert_postgres"] = measure(lambda: load_into_postgres(db_connection, signups), scale,
+                                                   measure_memory)
+    return results
+
+
+def run_zoom_stages(server, zoom, scale, measure_memory):
+    results = {}
+    fetched_instances = min(scale, MAX_ZOOM_FETCHED_INSTANCES)
+    server.zoom_instances_count = fetched_instances
+    branches = synthetic_payloads.ZOOM_BENCHMARK_BRANCHES
+    (meeting_instances, _), results["zoom_fetch"] = measure(
+        lambda: zoom.fetch_new_meetings(branches, full_refresh=True), fetched_instances, measure_memory)
+    results["zoom_fetch"]["rows"] = len(meeting_instances)
+    meetings_details = list(synthetic_payloads.iter_meetings_details(scale))
+    insert_ts = datetime.utcnow().strftime("%d-%m-%Y %H:%M:%S")
+    _, results["zoom_dataframe"] = measure(
+        lambda: pd.DataFrame([zoom.project_meeting_details(details, insert_ts) for details in meetings_details],
+                             columns=import_zoom.MEETING_INSTANCES_COLUMNS), scale, measure_memory)
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results, baseline_results):
+    """
+    Prints the throughput of every stage relative to the baseline (above 1 is faster).
+    """
+    for scale, stages in results.items():
+        for stage, stats in stages.items():
+            baseline_stats = baseline_results.get(scale, {}).get(stage)
+            if baseline_stats and baseline_stats.get("rows_per_second") and stats.get("rows_per_second"):
+                print("%s @ %s: %.2fx throughput" % (stage, scale,
+                                                     stats["rows_per_second"] / baseline_stats["rows_per_second"]))
+
+
+def run_benchmarks(scales, output_file, db_config=None, db_section=dbc.DEFAULT_CONFIG_SECTION, measure_memory=True):
+    """
+    Runs all the stages at every scale and writes the results to the output file.
+    :return: dict of scale -> stage -> measurements.
+    """
+    db_connection = None
+    if db_config is not None:
+        db_connection = dbc.DBconnection(os.path.abspath(db_config), db_section)
+    results = {}
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as config_dir, StubApiServer() as server:
+        connector = EventbriteConnector(write_eventbrite_config(config_dir), requests_per_hour=UNLIMITED_RATE)
+        write_zoom_config(config_dir)
+        os.chdir(config_dir)
+        try:
+            zoom = import_zoom.Zoom(requests_per_second=UNLIMITED_RATE, api_url=server.url + "/v2/")
+        finally:
+            os.chdir(working_dir)
+        for scale in scales:
+            print("Benchmarking %d rows" % scale)
+            results[str(scale)] = run_eventbrite_stages(server, connector, scale, db_connection, measure_memory)
+            results[str(scale)].update(run_zoom_stages(server, zoom, scale, measure_memory))
+            for stage, stats in results[str(scale)].items():
+                print("%s: %.2f seconds, %s rows/second" % (stage, stats["seconds"], stats["rows_per_second"]))
+    with open(output_file, "w") as json_file:
+        json.dump({"commit": get_commit(),
+                   "created_at": datetime.utcnow().isoformat(),
+                   "python": sys.version.split()[0],
+                   "pandas": pd.__version__,
+                   "platform": platform.platform(),
+                   "results": results}, json_file, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the ETL hot paths offline")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                        help="the amounts of attendees to benchmark with")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_FILE, help="the json file the results are written to")
+    parser.add_argument("--compare", help="a results file of a previous run to compare the throughput with")
+    parser.add_argument("--db-config", help="a Postgres config file (as configs/database.ini) to load the rows into, "
+                                            "instead of streaming them into a stand-in")
+    parser.add_argument("--db-section", default=dbc.DEFAULT_CONFIG_SECTION)
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory measurements")
+    args = parser.parse_args()
+    benchmark_results = run_benchmarks(args.scales, args.output, args.db_config, args.db_section,
+                                       not args.no_memory)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            print_comparison(benchmark_results, json.load(baseline_file)["results"])
@@ -0,0 +1,91 @@
+import re
+import json
+import threading
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from benchmarks import synthetic_payloads
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    """
+    Serves the Eventbrite and Zoom APIs the connectors use, with synthetic payloads generated on request, so only one
+    page is held in memory at a time whatever the scale.
+    """
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are sent separately, with Nagle's algorithm every response would wait for a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        split_url = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(split_url.query).items()}
+        payload = self.server.route(split_url.path, query)
+        if payload is None:
+            self.send_json(404, {"code": 3001, "message": "Not found"})
+        else:
+            self.send_json(200, payload)
+
+    def send_json(self, status_code, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # every request is logged to stderr by default, which would dominate the benchmark.
+        pass
+
+
+class StubApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, attendees_count=0, zoom_instances_count=0):
+        """
+        :param attendees_count: int represents the amount of attendees of every Eventbrite event.
+        :param zoom_instances_count: int represents the amount of Zoom meeting instances over all the branches.
+        """
+        super().__init__(("127.0.0.1", 0), StubApiHandler)
+        self.attendees_count = attendees_count
+        self.zoom_instances_count = zoom_instances_count
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def route(self, path, query):
+        """
+        :return: the payload of the request, None when the path is unknown.
+        """
+        match = re.fullmatch(r"/v3/events/(\w+)/attendees/", path)
+        if match:
+            return synthetic_payloads.build_attendees_page(self.attendees_count, int(query.get("continuation", 0)),
+                                                           match.group(1))
+        match = re.fullmatch(r"/v2/users/branch(\w+)@she-codes.org/meetings", path)
+        if match:
+            return synthetic_payloads.build_zoom_meetings_page(match.group(1), self.zoom_instances_count,
+                                                               int(query.get("page_size", 30)),
+                                                               int(query.get("next_page_token") or 0))
+        match = re.fullmatch(r"/v2/past_meetings/(\d+)/instances", path)
+        if match:
+            return synthetic_payloads.build_meeting_instances(match.group(1))
+        match = re.fullmatch(r"/v2/past_meetings/([^/]+)", path)
+        if match:
+            return synthetic_payloads.build_meeting_details(unquote(match.group(1)))
+        return None
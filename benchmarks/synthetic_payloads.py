@@ -0,0 +1,122 @@
+from Connectors.EventbriteConnector import SIGNUPS_BOOLEAN_ANSWER_COLUMNS
+
+# the page size of the Eventbrite list APIs.
+EVENTBRITE_PAGE_SIZE = 50
+BENCHMARK_EVENT_ID = "100200300"
+ZOOM_BENCHMARK_BRANCHES = ["10", "20", "30", "40", "50", "60", "70", "80", "90", "100", "200", "300"]
+ZOOM_INSTANCES_PER_MEETING = 10
+
+# eventbrite question -> the answers the attendees choose from (by their index).
+ANSWER_CHOICES = {
+    "Are you looking for a job in a technological field? ": ["Yes", "No", "Not now"],
+    "Company Name": ["Acme", "Globex", "Initech", "Hooli", "Umbrella"],
+    "Do you have an academic degree? if yes, what is your graduation year?": ["No", "2015", "2019", "2020", "2021"],
+    "From which branch?": ["Tel Aviv", "Haifa", "Jerusalem", "Beer Sheva", "Online"],
+    "Has your scope of work or your salary been reduced as a result of the corona crisis?": ["Yes", "No"],
+    "How many years of experience do you have?": ["0", "1-2", "3-5", "5+"],
+    "Job Title": ["Developer", "Student", "QA Engineer", "Product Manager"],
+    "What is your estimated graduation year? ": ["2021", "2022", "2023"],
+    "Which lesson are you at?": ["1", "5", "10", "15"],
+    "Which Track do you study?": ["Web", "Python", "Data Science"],
+}
+ANSWER_CHOICES.update({question: ["Yes", "No"] for question in SIGNUPS_BOOLEAN_ANSWER_COLUMNS.values()})
+ANSWERED_QUESTIONS = list(ANSWER_CHOICES)
+
+
+def build_attendee(index, event_id=BENCHMARK_EVENT_ID):
+    """
+    :return: deterministic raw Eventbrite attendee record, every few attendees skip some of the questions.
+    """
+    answers = [{"question": question, "type": "text",
+                "answer": ANSWER_CHOICES[question][(index + offset) % len(ANSWER_CHOICES[question])]}
+               for offset, question in enumerate(ANSWERED_QUESTIONS) if (index + offset) % 7 != 0]
+    return {"id": str(index),
+            "event_id": event_id,
+            "created": "2021-%02d-%02dT%02d:%02d:00Z" % (index % 12 + 1, index % 28 + 1, index % 24, index % 60),
+            "ticket_class_id": str(1000 + index % 3),
+            "status": "Attending",
+            "profile": {"email": "attendee%d@example.com" % index, "first_name": "Attendee", "last_name": str(index)},
+            "answers": answers}
+
+
+def build_attendees_page(attendees_count, page_number, event_id=BENCHMARK_EVENT_ID):
+    """
+    :param attendees_count: int represents the amount of attendees of the event (over all the pages).
+    :param page_number: int represents the page number, from 0.
+    :return: Eventbrite attendees page response, the continuation is the next page number.
+    """
+    start = page_number * EVENTBRITE_PAGE_SIZE
+    end = min(attendees_count, start + EVENTBRITE_PAGE_SIZE)
+    return {"pagination": {"object_count": attendees_count, "page_number": page_number + 1,
+                           "page_size": EVENTBRITE_PAGE_SIZE, "has_more_items": end < attendees_count,
+                           "continuation": str(page_number + 1)},
+            "attendees": [build_attendee(index, event_id) for index in range(start, end)]}
+
+
+def get_zoom_meetings_count(instances_count):
+    return max(1, -(-instances_count // ZOOM_INSTANCES_PER_MEETING))
+
+
+def get_zoom_meeting_ids(branch, instances_count):
+    """
+    :return: list of the ids of the branch's meetings, the meetings are spread over the branches round robin.
+    """
+    branch_index = ZOOM_BENCHMARK_BRANCHES.index(branch)
+    return [str(90000000 + meeting_index)
+            for meeting_index in range(branch_index, get_zoom_meetings_count(instances_count),
+                                       len(ZOOM_BENCHMARK_BRANCHES))]
+
+
+def build_zoom_meeting(meeting_id):
+    return {"uuid": "meeting-" + meeting_id, "id": int(meeting_id), "host_id": "host" + meeting_id[-2:],
+            "topic": "Lesson " + meeting_id[-3:], "type": 8, "start_time": "2021-06-01T16:00:00Z", "duration": 120,
+            "timezone": "Asia/Jerusalem", "created_at": "2021-05-01T10:00:00Z",
+            "join_url": "https://zoom.us/j/" + meeting_id}
+
+
+def build_zoom_meetings_page(branch, instances_count, page_size, page_number):
+    """
+    :return: Zoom list meetings page response of the branch, the next_page_token is the next page number.
+    """
+    meeting_ids = get_zoom_meeting_ids(branch, instances_count)
+    page_ids = meeting_ids[page_number * page_size:(page_number + 1) * page_size]
+    has_more = (page_number + 1) * page_size < len(meeting_ids)
+    return {"page_size": page_size, "total_records": len(meeting_ids),
+            "next_page_token": str(page_number + 1) if has_more else "",
+            "meetings": [build_zoom_meeting(meeting_id) for meeting_id in page_ids]}
+
+
+def get_meeting_instance_uuid(meeting_id, instance_index):
+    return "instance-%s-%d" % (meeting_id, instance_index)
+
+
+def build_meeting_instances(meeting_id):
+    return {"meetings": [{"uuid": get_meeting_instance_uuid(meeting_id, instance_index),
+                          "start_time": "2021-%02d-%02dT16:00:00Z" % (instance_index % 12 + 1, instance_index % 28 + 1)}
+                         for instance_index in range(ZOOM_INSTANCES_PER_MEETING)]}
+
+
+def build_meeting_details(uuid):
+    """
+    :param uuid: string represents the instance uuid, as returned by get_meeting_instance_uuid.
+    :return: Zoom past meeting details response of the instance.
+    """
+    _, meeting_id, instance_index = uuid.split("-")
+    instance_index = int(instance_index)
+    return {"uuid": uuid, "id": int(meeting_id), "host_id": "host" + meeting_id[-2:],
+            "type": 8, "topic": "Lesson " + meeting_id[-3:], "user_name": "Branch",
+            "user_email": "branch@she-codes.org",
+            "start_time": "2021-%02d-%02dT16:00:00Z" % (instance_index % 12 + 1, instance_index % 28 + 1),
+            "end_time": "2021-%02d-%02dT18:00:00Z" % (instance_index % 12 + 1, instance_index % 28 + 1),
+            "duration": 120, "total_minutes": 1500 + instance_index, "participants_count": 20 + instance_index}
+
+
+def iter_meetings_details(instances_count):
+    """
+    :return: yields the details responses of instances_count instances.
+    """
+    for meeting_index in range(get_zoom_meetings_count(instances_count)):
+        meeting_id = str(90000000 + meeting_index)
+        for instance_index in range(min(ZOOM_INSTANCES_PER_MEETING,
+                                        instances_count - meeting_index * ZOOM_INSTANCES_PER_MEETING)):
+            yield build_meeting_details(get_meeting_instance_uuid(meeting_id, instance_index))
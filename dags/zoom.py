@@ -1,32 +1,40 @@
+import os
 from airflow import DAG
-from airflow.operators.python import PythonOperator
+from airflow.decorators import task
 from datetime import datetime, timedelta
-from ETL.api_imports.zoom import import_zoom
+# only the lightweight task entry points are imported here, the import itself is loaded when a task runs.
+from ETL.api_imports.zoom import zoom_tasks
+from ETL.api_imports.zoom.zoom_settings import BRANCHES
 
-def call_import():
-    return 0
+# the branch tasks hand their results to the load task through files in this directory (one directory per run), and
+# only the files paths through XCom. The tasks may run on different hosts (Celery or Kubernetes executors), so
+# ZOOM_STAGING_DIR must be storage shared by all the workers.
+STAGING_DIR = os.environ.get("ZOOM_STAGING_DIR", "/tmp/zoom_staging")
+# the amount of branches imported at the same time, they share Zoom's rate limit.
+MAX_ACTIVE_BRANCHES = 4
 
 default_args = {
     'owner': 'airflow',
     'depends_on_past': False,
-    'start_date':'datetime(2021,06,01)',
-    'retries':3
+    'start_date': datetime(2021, 6, 1),
+    'retries': 3,
+    'retry_delay': timedelta(minutes=5)
 }
 with DAG(
     dag_id='zoom_import',
     default_args=default_args,
     catchup=False,
-    schedule_interval='@weekly'
+    schedule_interval='@weekly',
+    params={'full_refresh': False}
 ) as dag:
 
-    t1 = PythonOperator(
-        task_id='import_zoom_branches',
-        python_callable=call_import
-    )
+    @task(max_active_tis_per_dag=MAX_ACTIVE_BRANCHES)
+    def import_zoom_branch(branch, params=None, run_id=None):
+        return zoom_tasks.stage_branch(branch, os.path.join(STAGING_DIR, run_id), params['full_refresh'],
+                                       MAX_ACTIVE_BRANCHES)
 
-    t2 = PythonOperator(
-        task_id='import_zoom_classes',
-        python_callable=call_import
-    )
+    @task
+    def load_zoom_meetings(staged_files, run_id=None):
+        return zoom_tasks.load_staged(staged_files, os.path.join(STAGING_DIR, run_id))
 
-t1 >> t2
\ No newline at end of file
+    load_zoom_meetings(import_zoom_branch.expand(branch=BRANCHES))